@@ -5,21 +5,32 @@
 # ---------------------------------------------------------------------
 
 # App Libraries
-import os
+import time
 import streamlit as st
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 
-# Dashboard Libraries
-from matplotlib import pyplot as plt
-import pandas as pd
-from wordcloud import WordCloud, STOPWORDS
-from matplotlib.colors import LinearSegmentedColormap
+# Time each script run, reported at the bottom of the sidebar
+SCRIPT_START = time.perf_counter()
 
 # My Functions
+# Dashboard libraries (pandas, matplotlib, wordcloud) and the topic model are heavy to
+# import, so they are imported by the pages and functions that use them, on first use
 from functions.JournalFunctions import JournalFunctions as jf
-from functions.SentimentFunctions import SentimentFunctions as sf
+from functions.SentimentFunctions import SentimentFunctions as sf, TopicClassifier, MOODS
 from functions.WeatherFunctions import WeatherFunctions as wth
+from functions.EnrichmentFunctions import EnrichmentWorker
+from functions.CacheFunctions import EntryCache
+from functions.ImageFunctions import ImageFunctions as imf, ImageUrlCache
+from functions.EmbeddingFunctions import PgVectorIndex, LocalEmbeddingIndex, find_similar
+from functions.TraceFunctions import instrument, start_trace
+
+# Trace calls to the database, storage, weather API and topic model made during this run
+trace = start_trace()
+for traced_class in (jf, sf, wth, imf, ImageUrlCache):
+    instrument(traced_class)
+instrument(EntryCache, names=["sync"])
+instrument(TopicClassifier, names=["__init__", "encode"])
 
 # ---------------------------------------------------------------------
 # Theme Setup
@@ -27,8 +38,6 @@ from functions.WeatherFunctions import WeatherFunctions as wth
 
 # Theme Colours
 colors = ["#E2A9C2", "#4A2E54", "#253746", "#7B3357", "#CED9E5"]
-# Custom color map for word cloud
-custom_cmap = LinearSegmentedColormap.from_list("custom_theme", colors)
 
 # Custom theme adjustments
 st.markdown("""
@@ -52,17 +61,75 @@ html, body, [data-testid="stAppViewContainer"], [data-testid="stMarkdownContaine
 # Set working directory
 THIS_FOLDER = Path(__file__).parent.resolve()
 
-# Supabase Database connection
-from supabase import create_client, Client
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"] # anon key for read/write, or service role for secure API
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Supabase Database connection, created once per process
+# Set LOCAL_DB_PATH (and optionally LOCAL_IMAGE_DIR) to run on local disk instead
+@st.cache_resource
+def get_supabase():
+    if st.secrets.get("LOCAL_DB_PATH"):
+        from functions.LocalFunctions import LocalClient
+        return LocalClient(st.secrets["LOCAL_DB_PATH"], st.secrets.get("LOCAL_IMAGE_DIR", "local-images"))
+    from supabase import create_client
+    SUPABASE_URL = st.secrets["SUPABASE_URL"]
+    SUPABASE_KEY = st.secrets["SUPABASE_KEY"] # anon key for read/write, or service role for secure API
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+supabase = get_supabase()
 
 # Weather API setup
 LAT = st.secrets["LAT"]
 LONG = st.secrets["LONG"]
 WEATHER_API_KEY = st.secrets['WeatherAPIKey']
 
+# Score sentiment and mood automatically with VADER instead of asking for them
+AUTO_SENTIMENT = st.secrets.get("AUTO_SENTIMENT", False)
+
+# Local cache of entries, shared across reruns and only synced with changed rows
+@st.cache_resource
+def get_entry_cache():
+    return EntryCache(supabase, snapshot_path=st.secrets.get("CACHE_PATH"))
+
+cache = get_entry_cache()
+
+# Signed image URLs, shared across pages and reused until they are about to expire
+@st.cache_resource
+def get_image_urls():
+    return ImageUrlCache(supabase)
+
+image_urls = get_image_urls()
+
+# Word counts for the word cloud, updated incrementally as entries change (used by Home only)
+@st.cache_resource
+def get_word_index():
+    from functions.WordCloudFunctions import WordIndex
+    instrument(WordIndex, names=["sync", "render"])
+    return WordIndex(st.secrets.get("WORD_INDEX_PATH"))
+
+# Correlations and mood breakdowns, extended day by day as entries are added (used by Statistics only)
+@st.cache_resource
+def get_analytics():
+    from functions.AnalyticsFunctions import Analytics
+    instrument(Analytics, names=["sync", "update"])
+    return Analytics()
+
+# Entry embeddings for finding similar entries, in Supabase unless a local path is configured
+@st.cache_resource
+def get_embeddings():
+    if st.secrets.get("EMBEDDINGS_PATH"):
+        return LocalEmbeddingIndex(st.secrets["EMBEDDINGS_PATH"])
+    return PgVectorIndex(supabase)
+
+embeddings = get_embeddings()
+
+# Background worker for topic and weather lookups, shared across reruns
+@st.cache_resource
+def get_enrichment_worker():
+    worker = EnrichmentWorker(supabase, LAT, LONG, WEATHER_API_KEY, on_done=cache.invalidate, embeddings=embeddings)
+    # Pick up entries saved before the app last stopped that were never enriched
+    worker.resume(sentiment=AUTO_SENTIMENT)
+    return worker
+
+enrichment = get_enrichment_worker()
+
 # ---------------------------------------------------------------------
 # 1. Password protection - Removed section as app is private for now
 # ---------------------------------------------------------------------
@@ -97,7 +164,8 @@ WEATHER_API_KEY = st.secrets['WeatherAPIKey']
 st.set_page_config(page_title="Gratitude Journal", page_icon="🌸", layout="centered")
 # Configure sidebar
 st.sidebar.title('Where to?')
-page = st.sidebar.radio("Use below to navigate", ["Home", "Add Entry", "Timeline", "Edit Entries", "Statistics"])
+page = st.sidebar.radio("Use below to navigate", ["Home", "Add Entry", "Timeline", "Search", "Edit Entries", "Statistics"])
+trace.name = page
 
 # ---------------------------------------------------------------------
 # 3. Home Page
@@ -107,53 +175,34 @@ if page == "Home":
     st.title("🌸 What are you grateful for?")
     st.markdown("*Make now always the most precious time. Now will never come again. - Jean-Luc Picard*")
 
-    entries = jf.get_entries(supabase)
-    df = pd.DataFrame(entries)
+    entries = cache.get_entries()
 
     # Display message if no entries
     if not entries:
         st.info("No entries yet. Add one from the 'Add Entry' tab.")
     # Otherwise display word cloud and image gallery
     else:
-        # Create word cloud of entries
-        text = ' '.join(df['entrytext'].dropna().tolist()) # combine all text entries
-        text = text.replace("’", "'")  # normalise curly apostrophes
-        text = text.replace("'", "")   # strip all apostrophes
-        # Add stop words
-        custom_stopwords = STOPWORDS.union({
-        'today', 'really', 'just', 'like', 'one', 'something', 'got',
-        'feel', 'felt', 'time', 'day', 'much', 'make', 'made', 'wasn'
-        't', 's', 'm', 've', 'll',
-        "dont", "cant", "wont", "im", "youre", "hes", "shes", "its", "were", "theyre",
-        "wasnt", "werent", "isnt", "arent", "havent", "hasnt", "hadnt", "id", "youd",
-        "hed", "shed", "wed", "theyd", "ill", "youll", "hell", "shell", "well", "theyll",
-        "ive", "youve", "weve", "theyve", "whod", "wholl", "whos", "shouldnt", "wouldnt",
-        "couldnt", "mightnt", "mustnt", "neednt", "aint", "grateful", "someone else", "health",
-        "still", "someone", "thing", "things", "also", "even", "way", "ways",
-        "bit", "little", "lot", "lots", "part", "parts", "think", "know"
-        })
-
-        # Generate word cloud with custom theme
-        wordcloud = WordCloud(
+        # Custom color map for word cloud
+        from matplotlib.colors import LinearSegmentedColormap
+        custom_cmap = LinearSegmentedColormap.from_list("custom_theme", colors)
+
+        # Update word counts for new, edited and deleted entries, then draw the word cloud
+        word_index = get_word_index()
+        word_index.sync(entries)
+        wordcloud = word_index.render(
             width=600, height=300,
             background_color="#F3D9E5",
-            colormap=custom_cmap,
-            stopwords=custom_stopwords
-        ).generate(text)
-        st.image(wordcloud.to_array())
+            colormap=custom_cmap
+        )
+        if wordcloud is not None:
+            st.image(wordcloud)
 
         # Gallery of images
-        all_images = []
         cols_per_row = 4
-        # Loop to retrieve images
-        for entry in entries:
-            image_path = entry["imagepath"]
-            if image_path:
-                signed_url = supabase.storage.from_("journal-images").create_signed_url(
-                    image_path,
-                    expires_in=3600  # 1 hour
-                )["signedURL"]
-                all_images.append(signed_url)
+        # Sign all image paths in one request
+        image_paths = [imf.display_path(entry, 150) for entry in entries if entry["imagepath"]]
+        signed_urls = image_urls.get_urls(image_paths)
+        all_images = [signed_urls[path] for path in image_paths if path in signed_urls]
 
         # Display images in a grid
         for i in range(0, len(all_images), cols_per_row):
@@ -173,7 +222,7 @@ elif page == "Add Entry":
     with st.form("entry_form", clear_on_submit=True):
         now = datetime.now().date()
         now_str = now.strftime("%Y-%m-%d")
-        entry_exist = jf.entry_exist(supabase, (now_str,))
+        entry_exist = cache.entry_exist(now_str)
         # Add a warning if an entry for the day already exists
         if entry_exist:
             st.warning("⚠️ An entry for this date already exists. Please edit it in the 'View / Edit Entries' tab.")
@@ -182,51 +231,63 @@ elif page == "Add Entry":
         else:
             text = st.text_area("What are you grateful for today? (Name at last one small thing, on thing you did for your health, and one thing you did for someone else.)", height=200)
             steps = st.text_area("How many steps have you walked today?")
-            sentiment = st.slider('How do you feel today?', min_value=-1.0, max_value=1.0, step=0.1, value=0.0) # Added to replace function call
-            mood = st.select_slider('Select your mood', options=['Depressed', 'Sad', 'Okay', 'Happy', 'Elated'], value='Okay') # Added to replace function call
+            sentiment = mood = None
+            if not AUTO_SENTIMENT:
+                sentiment = st.slider('How do you feel today?', min_value=-1.0, max_value=1.0, step=0.1, value=0.0) # Added to replace function call
+                mood = st.select_slider('Select your mood', options=MOODS, value='Okay') # Added to replace function call
             image = st.file_uploader("Add a picture (optional)", type=["jpg", "jpeg", "png"])
             image_path = None
+            image_thumbs = None
+            image_hash = None
             submitted = st.form_submit_button("Save Entry")
             if submitted and text.strip():
-                # Save image to Supabase Storage if provided
+                # Save image to Supabase Storage if provided, named by its content so a photo already stored is not uploaded again
                 if image is not None:
-                    # Compile unique filename
-                    filename, ext = os.path.splitext(image.name)
-                    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-                    image_name = f"{filename}_{timestamp}{ext}"
-
-                    # Upload to Supabase Storage bucket "journal-images"
-                    file_bytes = image.getvalue()
-                    supabase.storage.from_("journal-images").upload(
-                        image_name,
-                        image.getvalue(),
-                        file_options={"content-type": image.type}
-                    )
-
-                    # Get public URL so you can display and store it
-                    image_path = image_name
-
-                # Get sentiment and weather data
-                # sentiment, mood = sf.get_sentiment(text) Temporarily replaced with direct user input
-                temperature, weather = wth.get_weather(LAT, LONG, WEATHER_API_KEY)
-                topic = sf.get_topic(text)
-                jf.add_entry(supabase, now_str, text, sentiment, mood, weather, temperature, topic, image_path)
-                jf.add_steps(supabase, now_str, steps)
+                    image_path, image_thumbs, image_hash = imf.store_image(supabase, image.getvalue(), image.name, image.type)
+
+                # Save the entry now and fill in weather and topic (and sentiment if automatic) in the background
+                eid = cache.add_entry(now_str, text, sentiment, mood, None, None, None, image_path, image_thumbs, image_hash)
+                cache.add_steps(now_str, steps)
+                enrichment.submit(eid, text, sentiment=AUTO_SENTIMENT)
                 # Display success message
-                st.success("✅ Entry saved!")
+                st.success("✅ Entry saved! Weather and topic will be added shortly.")
 
 # ---------------------------------------------------------------------
 # 5. Timeline of Entries
 # ---------------------------------------------------------------------
 elif page == "Timeline":
     st.title("📅 Timeline")
-    entries = jf.get_entries(supabase)
+    page_size = 10
+
+    # Show one page of entries at a time, paging by entry date so each rerun renders the same amount
+    if "timeline_cursors" not in st.session_state:
+        st.session_state.timeline_cursors = [] # before_date of each older page opened
+
+    def jump_timeline():
+        jump = st.session_state.timeline_jump
+        st.session_state.timeline_cursors = [(jump + timedelta(days=1)).isoformat()] if jump else []
+
+    st.date_input("Jump to date", value=None, key="timeline_jump", on_change=jump_timeline)
+    cursors = st.session_state.timeline_cursors
+    entries = cache.get_entries(limit=page_size, before_date=cursors[-1] if cursors else None)
     
     # Display message if no entries
-    if not entries:
+    if not entries and cursors:
+        st.info("No older entries.")
+    elif not entries:
         st.info("No entries yet. Add one from the 'Add Entry' tab.")
     # Otherwise display entries for timeline
     else:
+        # Offer to retry entries whose enrichment failed
+        if enrichment.failed():
+            if st.button("🔁 Retry failed enrichment"):
+                enrichment.retry_failed()
+                st.rerun()
+        # Sign all image paths in one request
+        try:
+            signed_urls = image_urls.get_urls(imf.display_path(entry, 300) for entry in entries)
+        except Exception:
+            signed_urls = {}
         for entry in entries:
             date = entry["entrydate"]
             text = entry["entrytext"]
@@ -239,9 +300,20 @@ elif page == "Timeline":
             topic = entry["topic"]
 
             with st.expander(f"{str(date)[:10]}", expanded=True):
+                # Show enrichment state while the entry is queued
+                state = enrichment.status(entry["entryid"])
+                if state == "failed":
+                    st.caption("⚠️ Weather and topic could not be added.")
+                elif state == "pending":
+                    st.caption("⏳ Enriching…")
+                weather = weather or ""
+                topic = topic or ""
+
                 # Replace weather description with an emoji
                 weather_image = ""
-                if "clear sky" in weather or "sun" in weather:
+                if not weather:
+                    weather_image = "…"
+                elif "clear sky" in weather or "sun" in weather:
                     weather_image = "☀️"
                 elif "thunder" in weather:
                     weather_image = "🌩️"
@@ -267,31 +339,90 @@ elif page == "Timeline":
                         st.write(f"{text}")
                     
                     with col_image:
-                        try:
-                            signed_url = supabase.storage.from_("journal-images").create_signed_url(
-                                image_path,
-                                expires_in=3600  # 1 hour
-                            )["signedURL"]
-    
+                        signed_url = signed_urls.get(imf.display_path(entry, 300))
+                        if signed_url:
                             st.image(signed_url, width=300)
-                        except Exception:
+                        else:
                             st.warning("⚠️ Image could not be loaded.")
                 else:
                     st.write(f"**Entry Text:** {text}")
 
+    # Page through newer and older entries
+    cols = st.columns(2)
+    with cols[0]:
+        if cursors and st.button("⬅️ Newer"):
+            cursors.pop()
+            st.rerun()
+    with cols[1]:
+        if len(entries) == page_size and st.button("Older ➡️"):
+            cursors.append(entries[-1]["entrydate"])
+            st.rerun()
+
+# ---------------------------------------------------------------------
+# 5a. Search Entries
+# ---------------------------------------------------------------------
+elif page == "Search":
+    st.title("🔎 Search")
+    mode = st.radio("Match by", ["Words", "Meaning"], horizontal=True)
+    query = st.text_input("Search your entries", placeholder='e.g. sunny walk, "coffee with" or walk -rain')
+
+    # Match on words with the full-text index
+    if query.strip() and mode == "Words":
+        page_size = 10
+        result_page = st.number_input("Page", min_value=1, value=1, step=1)
+        hits = jf.search_entries(supabase, query, limit=page_size, offset=(result_page - 1) * page_size)
+
+        # Display message if nothing matches
+        if not hits:
+            st.info("No matching entries.")
+        # Otherwise display ranked matches with the matching words highlighted
+        else:
+            for hit in hits:
+                topic = (hit["topic"] or "").capitalize()
+                with st.expander(f"{str(hit['entrydate'])[:10]} ● {topic}", expanded=True):
+                    st.markdown(hit["headline"])
+
+    # Match on meaning with the stored entry embeddings, e.g. "other days I felt like this"
+    elif query.strip() and mode == "Meaning":
+        entries_by_id = {entry["entryid"]: entry for entry in cache.get_entries()}
+        matches = [(entries_by_id[eid], similarity) for eid, similarity in find_similar(embeddings, text=query, k=10) if eid in entries_by_id]
+
+        # Display message if nothing matches
+        if not matches:
+            st.info("No similar entries yet.")
+        # Otherwise display the closest entries first
+        else:
+            for entry, similarity in matches:
+                topic = (entry["topic"] or "").capitalize()
+                with st.expander(f"{str(entry['entrydate'])[:10]} ● {topic} ({similarity:.0%} similar)", expanded=True):
+                    st.write(entry["entrytext"])
+
 # ---------------------------------------------------------------------
 # 6. Edit Entries
 # ---------------------------------------------------------------------
 
 elif page == "Edit Entries":
     st.title("📔 Edit Entries")
-    entries = jf.get_entries(supabase)
-    
+    latest = cache.get_entries(limit=1)
+
+    # Pick a single entry to edit, so only its controls are built
+    entries = []
+    if latest:
+        edit_date = st.date_input("Entry to edit", value=datetime.strptime(latest[0]["entrydate"][:10], "%Y-%m-%d").date())
+        entries = [e for e in cache.get_entries(limit=1, before_date=edit_date + timedelta(days=1)) if e["entrydate"][:10] == edit_date.isoformat()]
+
     # Display message if no entries
-    if not entries:
+    if not latest:
         st.info("No entries yet. Add one from the 'Add Entry' tab.")
+    elif not entries:
+        st.info("No entry for this date.")
     # Otherwise display entries for editing
     else:
+        # Sign all image paths in one request
+        try:
+            signed_urls = image_urls.get_urls(imf.display_path(entry, 300) for entry in entries)
+        except Exception:
+            signed_urls = {}
         for entry in entries:
             eid = entry["entryid"]
             date = entry["entrydate"]
@@ -304,140 +435,139 @@ elif page == "Edit Entries":
             steps = entry["steps"]
             topic = entry["topic"]
 
-            # Display with expander closed to make it easier to navigate
-            with st.expander(f"{str(date)[:10]}", expanded=False):
+            with st.expander(f"{str(date)[:10]}", expanded=True):
                 new_text = st.text_area("Edit text", text, key=f"text_{eid}")
                 new_image = st.file_uploader("Change picture (optional)", type=["jpg", "jpeg", "png"], key=f"image_{eid}")
-                new_sentiment = st.slider('How do you feel today?', min_value=-1.0, max_value=1.0, step=0.1, value=sentiment, key=f"sentiment_{eid}") # Added to replace function call
-                new_mood = st.select_slider('Select your mood', options=['Depressed', 'Sad', 'Okay', 'Happy', 'Elated'], value=mood, key=f"mood_{eid}") # Added to replace function call
-
-                new_image_path = None
-                if new_image is not None:
-
-                    # Compile unique filename
-                    filename, ext = os.path.splitext(new_image.name)
-                    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-                    new_image_name = f"{filename}_{timestamp}{ext}"
-
-                    # Upload to Supabase Storage bucket "journal-images"
-                    file_bytes = new_image.getvalue()
-                    supabase.storage.from_("journal-images").upload(
-                        new_image_name,
-                        new_image.getvalue(),
-                        file_options={"content-type": new_image.type}
-                    )
-
-                    # Get public URL so you can display and store it
-                    new_image_path = new_image_name
+                if not AUTO_SENTIMENT:
+                    # Entries scored automatically may have no sentiment yet, or a mood saved under VADER's names
+                    new_sentiment = st.slider('How do you feel today?', min_value=-1.0, max_value=1.0, step=0.1, value=sentiment if sentiment is not None else 0.0, key=f"sentiment_{eid}") # Added to replace function call
+                    new_mood = st.select_slider('Select your mood', options=MOODS, value=sf.normalise_mood(mood), key=f"mood_{eid}") # Added to replace function call
 
                 cols = st.columns(2)
                 with cols[0]:
                     if st.button("💾 Save changes", key=f"save_{eid}"):
-                        # new_sentiment, new_mood = sf.get_sentiment(new_text)
-                        new_temperature, new_weather = wth.get_weather(LAT, LONG, WEATHER_API_KEY)
-                        new_topic = sf.get_topic(new_text)
-                        jf.update_entry(supabase, eid, new_text, new_sentiment, new_mood, new_weather, new_temperature, new_topic, new_image_path)
+                        # Store a new picture only when saving, as the uploader keeps its file across reruns
+                        new_image_path = new_image_thumbs = new_image_hash = None
+                        if new_image is not None:
+                            new_image_path, new_image_thumbs, new_image_hash = imf.store_image(supabase, new_image.getvalue(), new_image.name, new_image.type)
+                        if AUTO_SENTIMENT:
+                            new_sentiment, new_mood = sf.get_sentiment(new_text)
+                        new_temperature, new_weather = wth.get_weather_for_entry(entry, LAT, LONG, WEATHER_API_KEY)
+                        new_topic, new_embedding = sf.get_topic_and_embedding(new_text)
+                        embeddings.add(eid, new_embedding)
+                        cache.update_entry(eid, new_text, new_sentiment, new_mood, new_weather, new_temperature, new_topic, new_image_path, new_image_thumbs, new_image_hash)
                         st.success("✅ Updated!")
                         st.rerun()
                 with cols[1]:
                     if st.button("🗑️ Delete entry", key=f"delete_{eid}"):
-                        jf.delete_entry(supabase, eid)
+                        cache.delete_entry(eid)
+                        embeddings.remove(eid)
                         st.warning("⚠️ Deleted.")
                         st.rerun()
                 if image_path:
-                    try:
-                        signed_url = supabase.storage.from_("journal-images").create_signed_url(
-                            image_path,
-                            expires_in=3600  # 1 hour
-                        )["signedURL"]
-
+                    signed_url = signed_urls.get(imf.display_path(entry, 300))
+                    if signed_url:
                         st.image(signed_url, width=300)
-                    except Exception:
+                    else:
                         st.warning("⚠️ Image could not be loaded.")
 
 # ---------------------------------------------------------------------
 # 7. Statistics Dashboard
 # ---------------------------------------------------------------------
 elif page == "Statistics":
+    import pandas as pd
+    from functions.ChartFunctions import ChartFunctions as chf, SERIES
+    instrument(chf)
+
     st.title("📈 Statistics")
-    entries = jf.get_entries(supabase)
+    granularity = st.radio("Group by", ["day", "week", "month"], horizontal=True, format_func=str.capitalize)
+    rollups = jf.get_rollups(supabase, granularity)
     # Display message if no graphs or data to show
-    if not entries:
+    if not rollups:
         st.info("No data yet to analyze.")
     # Otherwise display statistics
     else:
-        df = pd.DataFrame(entries)
-        df["entrydate"] = pd.to_datetime(df["entrydate"])
-        df.sort_values("entrydate", inplace=True)
-
-        # convert types
-        df["sentiment"] = pd.to_numeric(df["sentiment"], errors="coerce")
-        df["temperature"] = pd.to_numeric(df["temperature"], errors="coerce")
-        df["steps"] = pd.to_numeric(df["steps"], errors="coerce")
+        df = pd.DataFrame(rollups)
 
-        # group by date
-        daily_mood = df.groupby(df["entrydate"].dt.date)["sentiment"].mean()
-        daily_temp = df.groupby(df["entrydate"].dt.date)["temperature"].mean()
-        daily_steps = df.groupby(df["entrydate"].dt.date)["steps"].mean()
-
-        # Normalise for combined graph
-        def Normalise(series):
-            return (series - series.min()) / (series.max() - series.min())
-
-        mood_norm = Normalise(daily_mood)
-        temp_norm = Normalise(daily_temp)
-        steps_norm = Normalise(daily_steps)
+        # Averages per period, already grouped by the database, and their charts
+        series = chf.period_series(df, date_col="period")
+        charts = chf.render_charts(series)
 
         # -----------------------
         # Combined Normalised graph
         # -----------------------
         st.subheader("Mood, Temperature, and Steps Over Time (Normalised)")
-
-        fig, ax = plt.subplots(figsize=(10, 5))
-        ax.plot(mood_norm.index, mood_norm.values, marker="o", color="#4A2E54", label="Mood")
-        ax.plot(temp_norm.index, temp_norm.values, marker="o", color="#7B3357", label="Temperature")
-        ax.plot(steps_norm.index, steps_norm.values, marker="o", color="#E2A9C2", label="Steps")
-        ax.set_ylabel("Normalised Value (0-1)")
-        ax.set_xlabel("Date")
-        ax.set_title("Trends Over Time")
-        ax.legend()
-        ax.grid(True)
-        plt.xticks(rotation=90)
-        plt.tight_layout()
-        st.pyplot(fig)
+        st.image(charts["combined"], use_container_width=True)
 
         # -----------------------
         # Individual graphs
         # -----------------------
         st.subheader("Mood Over Time")
-        fig, ax = plt.subplots(figsize=(10, 3))
-        ax.plot(daily_mood.index, daily_mood.values, marker="o", color="#4A2E54")
-        ax.set_ylabel("Average Mood")
-        ax.set_xlabel("Date")
-        ax.set_ylim(-1, 1)
-        ax.grid(True)
-        plt.xticks(rotation=90)
-        plt.tight_layout()
-        st.pyplot(fig)
+        st.image(charts["sentiment"], use_container_width=True)
 
         st.subheader("Temperature Over Time")
-        fig, ax = plt.subplots(figsize=(10, 3))
-        ax.plot(daily_temp.index, daily_temp.values, marker="o", color="#7B3357")
-        ax.set_ylabel("Average Temperature (°C)")
-        ax.set_xlabel("Date")
-        ax.set_ylim(daily_temp.min() - 5, daily_temp.max() + 5)
-        ax.grid(True)
-        plt.xticks(rotation=90)
-        plt.tight_layout()
-        st.pyplot(fig)
+        st.image(charts["temperature"], use_container_width=True)
 
         st.subheader("Steps Over Time")
-        fig, ax = plt.subplots(figsize=(10, 3))
-        ax.plot(daily_steps.index, daily_steps.values, marker="o", color="#E2A9C2")
-        ax.set_ylabel("Average Steps")
-        ax.set_xlabel("Date")
-        ax.set_ylim(daily_steps.min() - 500, daily_steps.max() + 500)
-        ax.grid(True)
-        plt.xticks(rotation=90)
-        plt.tight_layout()
-        st.pyplot(fig)
\ No newline at end of file
+        st.image(charts["steps"], use_container_width=True)
+
+        # -----------------------
+        # Topics and moods
+        # -----------------------
+        st.subheader("Entries by Topic and Mood")
+        cols = st.columns(2)
+        with cols[0]:
+            st.bar_chart(pd.DataFrame(df["topiccounts"].tolist()).sum(), color="#7B3357")
+        with cols[1]:
+            st.bar_chart(pd.DataFrame(df["moodcounts"].tolist()).sum(), color="#E2A9C2")
+
+        # -----------------------
+        # Relationships
+        # -----------------------
+        # Only the days changed since the last run are read from the cache and worked out again
+        analytics = get_analytics().sync(cache)
+
+        st.subheader("Rolling Averages (Normalised)")
+        window = st.radio("Average over", list(analytics["rolling"]), horizontal=True, format_func=lambda days: f"{days} days")
+        rolling = chf.normalise(analytics["rolling"][window]).rename(columns={column: label for column, (label, _) in SERIES.items()})
+        st.line_chart(rolling, color=[color for _, color in SERIES.values()])
+
+        st.subheader("How Days Follow Each Other")
+        st.caption("Correlation between one series and another the given number of days later, from -1 to 1.")
+        st.dataframe(analytics["correlations"].round(2), use_container_width=True)
+
+        st.subheader("Mood by Topic and Weather")
+        cols = st.columns(2)
+        for col, grouping in zip(cols, ("topic", "weather")):
+            with col:
+                st.dataframe(analytics[grouping].round(2), use_container_width=True)
+
+# ---------------------------------------------------------------------
+# 8. Timings
+# ---------------------------------------------------------------------
+
+# Record the first run in this process as the cold start, and report it with this run's time
+@st.cache_resource
+def get_cold_start():
+    return {"ms": None}
+
+run_ms = (time.perf_counter() - SCRIPT_START) * 1000
+cold_start = get_cold_start()
+if cold_start["ms"] is None:
+    cold_start["ms"] = run_ms
+st.sidebar.caption(f"⏱️ Page ran in {run_ms:.0f} ms (cold start {cold_start['ms']:.0f} ms)")
+
+# Calls traced during this run, to see where a slow page spends its time (set DEBUG to show)
+if st.secrets.get("DEBUG"):
+    with st.sidebar.expander("🔍 Call timings"):
+        calls = trace.summary()
+        if calls:
+            st.dataframe(
+                calls, hide_index=True, use_container_width=True,
+                column_config={
+                    "total_ms": st.column_config.NumberColumn("total ms", format="%.1f"),
+                    "max_ms": st.column_config.NumberColumn("max ms", format="%.1f")
+                }
+            )
+        else:
+            st.caption("No traced calls on this run.")
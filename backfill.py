@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# Re-score the topic of every journal entry, e.g. after changing the topic
+# descriptions, and optionally score the sentiment of entries saved without one.
+# Sentiment already on an entry, e.g. from the sliders, is never changed.
+#
+#   python backfill.py --fields topic sentiment --workers 4 --checkpoint backfill.json
+#
+# Uses SUPABASE_URL and SUPABASE_KEY, or LOCAL_DB_PATH for a local database, as
+# steps_api.py does. Run again with the same checkpoint to carry on after a stop.
+
+import os
+import argparse
+from functions.BackfillFunctions import Backfill, FIELDS, DEFAULT_FIELDS
+from functions.EmbeddingFunctions import PgVectorIndex, LocalEmbeddingIndex
+
+# Database connection
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+LOCAL_DB_PATH = os.environ.get("LOCAL_DB_PATH") # set to use a local SQLite database instead
+EMBEDDINGS_PATH = os.environ.get("EMBEDDINGS_PATH") # set if the app keeps embeddings locally
+
+def get_client():
+    if LOCAL_DB_PATH:
+        from functions.LocalFunctions import LocalClient
+        return LocalClient(LOCAL_DB_PATH)
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score the topic of every journal entry, and score missing sentiment.")
+    parser.add_argument("--fields", nargs="+", choices=FIELDS, default=list(DEFAULT_FIELDS), help="Fields to score, sentiment only where missing (default: topic)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, 0 to score in this process")
+    parser.add_argument("--page-size", type=int, default=500, help="Entries read and written at a time")
+    parser.add_argument("--batch-size", type=int, default=64, help="Entries scored per model call")
+    parser.add_argument("--checkpoint", default="backfill.json", help="Progress file, to resume an interrupted run")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first entry")
+    parser.add_argument("--no-embeddings", action="store_true", help="Don't store the new topic embeddings")
+    args = parser.parse_args(argv)
+
+    supabase = get_client()
+    embeddings = None
+    if not args.no_embeddings:
+        embeddings = LocalEmbeddingIndex(EMBEDDINGS_PATH) if EMBEDDINGS_PATH else PgVectorIndex(supabase)
+
+    backfill = Backfill(
+        supabase, args.fields, embeddings, args.checkpoint,
+        page_size=args.page_size, batch_size=args.batch_size, workers=args.workers
+    )
+    stats = backfill.run(restart=args.restart)
+    print(f"Scored {stats['entries']} entries in {stats['seconds']:.1f}s ({stats['per_second']:.1f} entries/s)")
+
+if __name__ == "__main__":
+    main()
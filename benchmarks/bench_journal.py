@@ -0,0 +1,495 @@
+#!/usr/bin/python3
+# Benchmarks for the journal's read, write and enrichment paths.
+# Synthetic journals are seeded into the local SQLite backend so runs are
+# repeatable without a Supabase project, and results are written as JSON
+# so a run can be compared against one from an earlier commit.
+#
+#   python benchmarks/bench_journal.py --sizes 1000 10000 --output bench.json
+#   python benchmarks/bench_journal.py --compare bench.json --output new.json
+
+# Imports
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+# Run from anywhere, importing the app's functions package
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from functions.LocalFunctions import LocalClient
+from functions.JournalFunctions import JournalFunctions as jf, utc_now
+from functions.CacheFunctions import EntryCache
+from functions.ImageFunctions import ImageFunctions as imf, ImageUrlCache
+from functions.SentimentFunctions import TOPICS
+
+# Words used to build synthetic entry text
+VOCABULARY = (
+    "grateful family walk park sunshine coffee friends work project cat Penny Basil "
+    "dinner garden rain run gym sleep book music team colleagues hike mountain tea "
+    "morning evening quiet laugh call sister brother partner kitchen bread lunch "
+    "meeting deadline finished started learned cooked cleaned trees river beach"
+).split()
+MOODS = [("Elated", 0.7), ("Happy", 0.3), ("Okay", 0.0), ("Sad", -0.3), ("Depressed", -0.7)]
+WEATHER = ["Clear", "Clouds", "Rain", "Drizzle", "Snow", "Mist"]
+
+
+# ---------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------
+
+def synthetic_text(rng, words=40):
+    """ Build a few sentences of random journal text.
+
+    Args:
+        rng: random.Random instance, so runs are repeatable
+        words: Number of words in the text"""
+    chosen = rng.choices(VOCABULARY, k=words)
+    sentences = [" ".join(chosen[i:i + 8]).capitalize() + "." for i in range(0, words, 8)]
+    return " ".join(sentences)
+
+
+def synthetic_image(rng, size=(640, 480)):
+    """ Build a small JPEG of a random colour, to stand in for an uploaded photo.
+
+    Args:
+        rng: random.Random instance, so runs are repeatable
+        size: Width and height of the image"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3))).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def seed_journal(client, count, seed=0, image_every=10, distinct_images=50, chunk_size=5000):
+    """ Fill a local backend with one entry and one step count per day, ending today.
+
+    Every image_every-th entry has an image, drawn from a small set of uploaded
+    images so seeding does not spend most of its time making thumbnails.
+
+    Args:
+        client: LocalClient to seed
+        count: Number of entries
+        seed: Random seed, so the same journal is built on every run
+        image_every: Give every n-th entry an image, 0 for none
+        distinct_images: Number of different images uploaded
+        chunk_size: Rows inserted per transaction"""
+    rng = random.Random(seed)
+    images = []
+    if image_every:
+        for i in range(min(distinct_images, count // image_every)):
+            paths = imf.upload_image(client, synthetic_image(rng), f"bench-{i}.jpg", "image/jpeg")
+            images.append((f"bench-{i}.jpg", paths))
+
+    first = date.today() - timedelta(days=count - 1)
+    entries, steps = [], []
+    for i in range(count):
+        day = (first + timedelta(days=i)).isoformat()
+        mood, sentiment = rng.choice(MOODS)
+        image_path, image_thumbs = images[i % len(images)] if images and i % image_every == 0 else (None, None)
+        entries.append({
+            "entrydate": day,
+            "entrytext": synthetic_text(rng),
+            "topic": rng.choice(list(TOPICS)),
+            "sentiment": round(sentiment + rng.uniform(-0.2, 0.2), 3),
+            "mood": mood,
+            "weather": rng.choice(WEATHER),
+            "temperature": round(rng.uniform(-5, 30), 1),
+            "imagepath": image_path,
+            "imagethumbs": image_thumbs,
+            "datecreated": utc_now()
+        })
+        steps.append((day, rng.randrange(500, 20000)))
+
+    for i in range(0, count, chunk_size):
+        client.table("entry").insert(entries[i:i + chunk_size]).execute()
+    jf.upsert_steps(client, steps, chunk_size)
+
+
+# ---------------------------------------------------------------------
+# Timing
+# ---------------------------------------------------------------------
+
+def timed(fn, repeat=5, warmup=0):
+    """ Time a function over several runs, returning a summary in seconds.
+
+    Args:
+        fn: Function taking no arguments
+        repeat: Number of timed runs
+        warmup: Number of untimed runs first"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"runs": repeat, "min": min(times), "median": statistics.median(times), "max": max(times)}
+
+
+def percentile(values, q):
+    """ Get the q-th percentile (0 to 100) of a list of values, by nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def skipped(reason):
+    return {"skipped": reason}
+
+
+# ---------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------
+
+def bench_get_entries(client, count, repeat):
+    """ Full reads and single Timeline pages, straight from the backend and through the entry cache."""
+    # A page from the middle of the journal, as when jumping to a date
+    middle = (date.today() - timedelta(days=count // 2)).isoformat()
+    results = {
+        "all": timed(lambda: jf.get_entries(client), repeat),
+        "page": timed(lambda: jf.get_entries(client, limit=10), repeat),
+        "page_before_date": timed(lambda: jf.get_entries(client, limit=10, before_date=middle), repeat)
+    }
+
+    # A new cache each time, so the first sync fetches everything
+    results["cache_cold"] = timed(lambda: EntryCache(client).get_entries(), max(1, repeat // 2))
+    cache = EntryCache(client)
+    cache.get_entries()
+    results["cache_warm"] = timed(lambda: cache.get_entries(), repeat)
+    results["cache_warm_page"] = timed(lambda: cache.get_entries(limit=10), repeat)
+    return results
+
+
+def bench_statistics(client, repeat):
+    """ The Statistics page: rollups from the backend, the per-period series and its charts."""
+    try:
+        import pandas as pd
+        from functions.ChartFunctions import ChartFunctions as chf, _chart_cache
+    except ImportError as e:
+        return skipped(str(e))
+
+    results = {}
+    for granularity in ("day", "week", "month"):
+        rollups = jf.get_rollups(client, granularity)
+        series = chf.period_series(pd.DataFrame(rollups), date_col="period")
+
+        def render_cold():
+            _chart_cache.clear()
+            chf.render_charts(series)
+
+        results[granularity] = {
+            "periods": len(series),
+            "rollups": timed(lambda: jf.get_rollups(client, granularity), repeat),
+            "series": timed(lambda: chf.period_series(pd.DataFrame(rollups), date_col="period"), repeat),
+            "render_cold": timed(render_cold, max(1, repeat // 2)),
+            "render_warm": timed(lambda: chf.render_charts(series), repeat, warmup=1)
+        }
+
+    # The same averages grouped in pandas from every entry, as the page did before rollups
+    entries = pd.DataFrame(jf.get_entries(client))
+    results["entries_groupby"] = timed(lambda: chf.period_series(entries), repeat)
+
+    # Analytics over the daily series: from scratch, unchanged, and with one more day appended
+    from functions.AnalyticsFunctions import AnalyticsFunctions as af, Analytics
+    cache = EntryCache(client)
+    warm = Analytics()
+    warm.sync(cache)
+    # Each appending run needs its own analytics built up to the day before, and only reads the new day
+    last_date = str(entries["entrydate"].max())[:10]
+    last_day = entries[entries["entrydate"].astype(str).str[:10] == last_date]
+    daily = af.daily_frame(entries)
+    before = []
+    for _ in range(repeat):
+        analytics = Analytics()
+        analytics.update(daily.iloc[:-1])
+        before.append(analytics)
+    results["analytics"] = {
+        "days": len(daily),
+        "full": timed(lambda: Analytics().update(af.daily_frame(entries)), repeat),
+        "cached": timed(lambda: warm.sync(cache), repeat),
+        "append_day": timed(lambda: before.pop().update(af.daily_frame(last_day), since=last_date), repeat)
+    }
+    return results
+
+
+def bench_word_cloud(client, repeat, workdir):
+    """ Home page word cloud: building the word index, re-syncing it and laying out the cloud."""
+    try:
+        from functions.WordCloudFunctions import WordIndex
+    except ImportError as e:
+        return skipped(str(e))
+
+    entries = jf.get_entries(client)
+    options = {"width": 600, "height": 300, "background_color": "#F3D9E5"}
+
+    def build():
+        index = WordIndex()
+        index.sync(entries)
+        return index
+
+    index = build()
+
+    def render_cold():
+        index._image_version = None
+        index.render(**options)
+
+    results = {
+        "index_build": timed(build, max(1, repeat // 2)),
+        "index_sync_unchanged": timed(lambda: index.sync(entries), repeat),
+        "render_cold": timed(render_cold, max(1, repeat // 2)),
+        "render_warm": timed(lambda: index.render(**options), repeat, warmup=1)
+    }
+
+    # Reloading a saved index, as a restarted app does
+    path = Path(workdir) / "word_index.json"
+    saved = WordIndex(path)
+    saved.sync(entries)
+    results["index_load"] = timed(lambda: WordIndex(path), repeat)
+    return results
+
+
+def bench_gallery(client, repeat):
+    """ Home page gallery: signing the thumbnail URL of every entry with an image."""
+    entries = jf.get_entries(client)
+    paths = [imf.display_path(entry, 150) for entry in entries if entry["imagepath"]]
+    urls = ImageUrlCache(client)
+
+    def cold():
+        urls.clear()
+        urls.get_urls(paths)
+
+    return {
+        "images": len(paths),
+        "urls_cold": timed(cold, repeat),
+        "urls_warm": timed(lambda: urls.get_urls(paths), repeat, warmup=1)
+    }
+
+
+def bench_topic(repeat):
+    """ Topic classification: the first call loads the model, later calls only encode."""
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError as e:
+        return skipped(str(e))
+    from functions.SentimentFunctions import SentimentFunctions as sf, get_topic_classifier
+
+    rng = random.Random(1)
+    texts = [synthetic_text(rng) for _ in range(64)]
+    start = time.perf_counter()
+    get_topic_classifier()
+    cold = time.perf_counter() - start
+    return {
+        "cold": {"runs": 1, "min": cold, "median": cold, "max": cold},
+        "warm": timed(lambda: sf.get_topic(texts[0]), repeat, warmup=1),
+        "batch_64": timed(lambda: sf.get_topics(texts), max(1, repeat // 2))
+    }
+
+
+def bench_add_steps(db_path, requests, concurrency):
+    """ Steps service under concurrent load, through the FastAPI app when it can be loaded.
+
+    Falls back to the service's write path, AsyncStepsFunctions.upsert_steps, on
+    an async local client if FastAPI or httpx are not installed.
+
+    Args:
+        db_path: Path of the seeded local database
+        requests: Total number of requests to send
+        concurrency: Number of requests in flight at once"""
+    payloads = [
+        {"date": (date.today() - timedelta(days=i % 365)).isoformat(), "steps": 1000 + i}
+        for i in range(requests)
+    ]
+
+    async def load(send):
+        queue = asyncio.Queue()
+        for payload in payloads:
+            queue.put_nowait(payload)
+        latencies = []
+
+        async def worker():
+            while not queue.empty():
+                payload = queue.get_nowait()
+                start = time.perf_counter()
+                await send(payload)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        return {
+            "requests": len(latencies),
+            "concurrency": concurrency,
+            "seconds": elapsed,
+            "requests_per_second": len(latencies) / elapsed,
+            "latency": {
+                "min": min(latencies),
+                "median": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies)
+            }
+        }
+
+    async def through_app():
+        import httpx
+        os.environ["LOCAL_DB_PATH"] = str(db_path)
+        import steps_api
+        steps_api.LOCAL_DB_PATH = str(db_path)
+        async with steps_api.lifespan(steps_api.app):
+            transport = httpx.ASGITransport(app=steps_api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+                async def send(payload):
+                    response = await http.post("/add_steps", json=payload)
+                    response.raise_for_status()
+                return await load(send)
+
+    async def through_write_path():
+        from functions.StepsFunctions import AsyncStepsFunctions as asf
+        client = LocalClient(db_path, asynchronous=True)
+        try:
+            return await load(lambda payload: asf.upsert_steps(client, [(payload["date"], payload["steps"])]))
+        finally:
+            await client.aclose()
+
+    try:
+        import httpx  # noqa: F401
+        import fastapi  # noqa: F401
+    except ImportError as e:
+        result = asyncio.run(through_write_path())
+        result["path"] = f"upsert_steps ({e})"
+        return result
+    result = asyncio.run(through_app())
+    result["path"] = "POST /add_steps"
+    return result
+
+
+# ---------------------------------------------------------------------
+# Running and comparing
+# ---------------------------------------------------------------------
+
+def run_size(count, args):
+    """ Seed a journal of the given size and run every benchmark against it."""
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        db_path = Path(workdir) / "journal.sqlite"
+        client = LocalClient(db_path, image_dir=Path(workdir) / "images")
+        start = time.perf_counter()
+        seed_journal(client, count, seed=args.seed)
+        results = {"seed_seconds": time.perf_counter() - start}
+        print(f"  seeded {count} entries in {results['seed_seconds']:.1f}s", flush=True)
+
+        benchmarks = {
+            "get_entries": lambda: bench_get_entries(client, count, args.repeat),
+            "statistics": lambda: bench_statistics(client, args.repeat),
+            "word_cloud": lambda: bench_word_cloud(client, args.repeat, workdir),
+            "gallery": lambda: bench_gallery(client, args.repeat),
+            "add_steps": lambda: bench_add_steps(db_path, args.requests, args.concurrency)
+        }
+        for name, bench in benchmarks.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = bench()
+            print(f"  {name} done", flush=True)
+        client.close()
+    return results
+
+
+def git_commit():
+    """ Get the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """ Flatten nested results into {"10000.get_entries.all": median seconds} for comparison."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict) and "median" in value:
+            flat[name] = value["median"]
+        elif isinstance(value, dict):
+            flat.update(flatten(value, name))
+    return flat
+
+
+def compare(baseline, current, threshold, min_delta=0.001):
+    """ Print the change in median time of every benchmark found in both runs.
+
+    Args:
+        baseline: Results loaded from an earlier run
+        current: Results of this run
+        threshold: Fractional slowdown reported as a regression, e.g. 0.2 for 20%
+        min_delta: Seconds a benchmark must slow by to be reported, so timer noise is ignored
+
+    Returns the names of the regressed benchmarks."""
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for name in sorted(old.keys() & new.keys()):
+        change = (new[name] - old[name]) / old[name] if old[name] else 0.0
+        flag = ""
+        if change > threshold and new[name] - old[name] > min_delta:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<55} {old[name] * 1000:10.2f}ms -> {new[name] * 1000:10.2f}ms  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the journal's read, write and enrichment paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Journal sizes to seed")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--requests", type=int, default=1000, help="Steps requests sent per size")
+    parser.add_argument("--concurrency", type=int, default=32, help="Steps requests in flight at once")
+    parser.add_argument("--only", nargs="+", help="Only run these benchmarks, e.g. get_entries statistics")
+    parser.add_argument("--skip-topic", action="store_true", help="Skip the topic model benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic journals")
+    parser.add_argument("--workdir", default=None, help="Directory for the temporary databases")
+    parser.add_argument("--output", default="bench.json", help="Path to write the JSON results to")
+    parser.add_argument("--compare", help="Earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Fractional slowdown reported as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.001, help="Seconds of slowdown below which changes are ignored")
+    args = parser.parse_args(argv)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+        "results": {}
+    }
+    for count in args.sizes:
+        print(f"Journal of {count} entries", flush=True)
+        report["results"][str(count)] = run_size(count, args)
+
+    # The model does not depend on the journal size, so it is timed once
+    if not args.skip_topic and (not args.only or "topic" in args.only):
+        report["results"]["topic"] = bench_topic(args.repeat)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold, args.min_delta)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
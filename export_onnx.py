@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# Export the MiniLM topic model to ONNX, quantize it to int8 and check it against
+# PyTorch, so the app can classify topics with onnxruntime instead of torch.
+#
+#   python export_onnx.py --output models/minilm-onnx
+#
+# Then set TOPIC_ONNX_PATH = "models/minilm-onnx" in secrets.toml (or the environment).
+# Needs torch, transformers and sentence-transformers to export, and onnxruntime
+# and tokenizers to run. Exits with an error if any topic choice differs.
+
+import sys
+import time
+import argparse
+import multiprocessing
+from pathlib import Path
+from functions.SentimentFunctions import TOPICS, TopicClassifier
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Example entries checked for the same topic from both models, along with the topic descriptions
+SAMPLE_TEXTS = [
+    "Had a lovely video call with my parents and auntie this evening.",
+    "James and Kezia came over for dinner and we laughed all night.",
+    "Went for a run before breakfast and felt great afterwards.",
+    "Finally got a good night's sleep and cooked a healthy lunch.",
+    "Finished the council project ahead of the deadline, the team was brilliant.",
+    "My boss gave me some kind feedback in our one to one.",
+    "Walked through the park and the trees were turning orange.",
+    "Climbed to the top of the hill and the view over the mountains was amazing.",
+    "Penny curled up on my lap all afternoon.",
+    "Basil caught his first leaf today, silly kitty.",
+    "Grateful for a quiet cup of tea in the garden.",
+    "Tidied the whole flat and went to the gym.",
+]
+
+
+def export(output, model_name=MODEL_NAME, opset=14):
+    """ Export the model and tokenizer to ONNX, then write an int8-quantized copy.
+
+    Args:
+        output: Directory to write model.onnx, model_quantized.onnx and tokenizer.json to
+        model_name: Hugging Face name of the model
+        opset: ONNX opset version to export with"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(output)
+
+    sample = tokenizer(["An example entry"], return_tensors="pt")
+    axes = {0: "batch", 1: "tokens"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            str(output / "model.onnx"),
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": axes, "attention_mask": axes, "token_type_ids": axes,
+                "last_hidden_state": axes
+            },
+            opset_version=opset
+        )
+    quantize_dynamic(str(output / "model.onnx"), str(output / "model_quantized.onnx"), weight_type=QuantType.QInt8)
+    return output
+
+
+def parity(onnx_path, texts):
+    """ Compare topics and embeddings from the ONNX model against PyTorch.
+
+    Args:
+        onnx_path: Directory of the exported model
+        texts: Texts to compare on
+
+    Returns the number of texts whose topic differs."""
+    torch_classifier = TopicClassifier()
+    onnx_classifier = TopicClassifier(onnx_path=onnx_path)
+
+    torch_embeddings = torch_classifier.encode(texts)
+    onnx_embeddings = onnx_classifier.encode(texts)
+    # Topics are chosen against each model's own topic embeddings, as in the app
+    torch_topics = torch_classifier.classify_embeddings(torch_embeddings)
+    onnx_topics = onnx_classifier.classify_embeddings(onnx_embeddings)
+    similarity = (torch_embeddings * onnx_embeddings).sum(axis=1)
+
+    differences = 0
+    for text, expected, got in zip(texts, torch_topics, onnx_topics):
+        if expected != got:
+            differences += 1
+            print(f"  DIFFERENT  torch={expected:<8} onnx={got:<8} {text[:60]}")
+    print(f"Topics matching: {len(texts) - differences}/{len(texts)}")
+    print(f"Embedding cosine similarity: min {similarity.min():.4f}, mean {similarity.mean():.4f}")
+    return differences
+
+
+def _measure(onnx_path, texts, repeat, results):
+    """ Time loading and encoding with one backend, run in a fresh process so memory is its own."""
+    import resource
+    start = time.perf_counter()
+    classifier = TopicClassifier(onnx_path=onnx_path)
+    load = time.perf_counter() - start
+    classifier.encode(texts[:1])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        classifier.encode(texts)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    results.put({
+        "load_s": load,
+        "encodes_per_s": repeat * len(texts) / elapsed,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+
+
+def compare_speed(onnx_path, texts, repeat=10):
+    """ Print load time, encodes per second and peak memory for PyTorch and ONNX."""
+    context = multiprocessing.get_context("spawn")
+    for name, path in (("torch", None), ("onnx", onnx_path)):
+        results = context.Queue()
+        process = context.Process(target=_measure, args=(path, texts, repeat, results))
+        process.start()
+        stats = results.get()
+        process.join()
+        print(f"  {name:<6} load {stats['load_s']:.2f}s, {stats['encodes_per_s']:.0f} encodes/s, peak memory {stats['max_rss_mb']:.0f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the topic model to quantized ONNX and check it matches PyTorch.")
+    parser.add_argument("--output", default="models/minilm-onnx", help="Directory to write the model to")
+    parser.add_argument("--skip-export", action="store_true", help="Only check an already exported model")
+    parser.add_argument("--texts", help="Optional file of extra texts to check, one per line")
+    parser.add_argument("--no-speed", action="store_true", help="Skip the speed and memory comparison")
+    args = parser.parse_args(argv)
+
+    if not args.skip_export:
+        print(f"Exporting {MODEL_NAME} to {args.output}")
+        export(args.output)
+
+    texts = list(TOPICS.values()) + SAMPLE_TEXTS
+    if args.texts:
+        texts += [line.strip() for line in Path(args.texts).read_text().splitlines() if line.strip()]
+    differences = parity(args.output, texts)
+    if not args.no_speed:
+        compare_speed(args.output, texts)
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+# Set of Python functions for finding relationships between mood, weather, steps and topic.
+# Rolling means, lagged correlations and mood by topic and weather are worked out
+# over the daily series in vectorised pandas and NumPy. They are kept as running
+# sums, so when days are added or changed only those days (and the few before
+# them that a lag or rolling window reaches back to) are worked out again.
+
+# Imports
+import threading
+import numpy as np
+import pandas as pd
+from functions.ChartFunctions import ChartFunctions as chf, SERIES
+from functions.SentimentFunctions import MOODS, LEGACY_MOODS
+
+# Columns describing each day, alongside the SERIES averages
+CATEGORIES = ("topic", "weather", "mood")
+
+# Series compared by lagged correlation, as (leading, following) pairs
+PAIRS = (("steps", "sentiment"), ("temperature", "sentiment"), ("sentiment", "steps"))
+
+# Columns of the per-group sums that are not mood counts
+_TOTALS = ("entries", "sum", "sumsq")
+
+# Chunks of days and rolling means kept before they are joined into one
+_MAX_CHUNKS = 32
+
+
+class AnalyticsFunctions:
+    @staticmethod
+    def daily_frame(df, date_col="entrydate"):
+        """ Build the daily series used for analytics from journal entries.
+
+        The averages are the period_series the Statistics charts use, joined with each day's
+        topic, weather and mood (those of the day's first entry, if it has more than one).
+        Moods saved under VADER's own names are mapped to the app's MOODS.
+
+        Args:
+            df: DataFrame of entries with a date column, SERIES columns and topic, weather and mood
+            date_col: Name of the date column to group by"""
+        if df.empty:
+            return pd.DataFrame(columns=list(SERIES) + list(CATEGORIES), index=pd.DatetimeIndex([], name="date"))
+        series = chf.period_series(df, date_col)
+        series.index = pd.to_datetime(series.index)
+        dates = pd.to_datetime(df[date_col]).dt.normalize().rename("date")
+        categories = df[list(CATEGORIES)].groupby(dates).first()
+        categories["mood"] = categories["mood"].replace(LEGACY_MOODS)
+        return series.join(categories)
+
+
+class Analytics:
+    """ Rolling means, lagged correlations and mood distributions of a daily series, updated incrementally.
+
+    Args:
+        windows: Rolling mean windows in days
+        lags: Days between the leading and following series of each correlated pair
+        pairs: (leading, following) column pairs to correlate"""
+    def __init__(self, windows=(7, 30), lags=(0, 1, 2, 3), pairs=PAIRS):
+        self.windows = tuple(windows)
+        self.lags = tuple(lags)
+        self.pairs = tuple(pairs)
+        # Days before a changed day that a lag or rolling window reaches back to
+        self.context = pd.Timedelta(days=max(max(self.windows) - 1, max(self.lags)))
+        self._lock = threading.RLock()
+        self.cache_version = None
+        self._results = None
+        self._days = []
+        self._rolling = {window: [] for window in self.windows}
+        self._sums = np.zeros((len(self.pairs), len(self.lags), 6))
+        self._groups = {column: pd.DataFrame(columns=list(_TOTALS), dtype=float) for column in ("topic", "weather")}
+
+    def sync(self, cache):
+        """ Get the analytics for the entries in an EntryCache, updating them from the days changed since the last call.
+
+        Results are kept for the cache's version, so a rerun with no changes costs nothing,
+        and a new or edited day only reads that day's entries from the cache.
+
+        Args:
+            cache: EntryCache of the journal's entries and steps
+
+        Returns the same dictionary as update."""
+        cache.sync()
+        with self._lock:
+            version, since = cache.changed_since(self.cache_version)
+            if since is None and self._results is not None:
+                return self._results
+            entries = cache.get_entries(since_date=since or None)
+            daily = AnalyticsFunctions.daily_frame(pd.DataFrame(entries))
+            results = self.update(daily, since=since or None)
+            self.cache_version = version
+            return results
+
+    def update(self, daily, since=None):
+        """ Replace the days from a date onwards and get the updated analytics.
+
+        Args:
+            daily: DataFrame from AnalyticsFunctions.daily_frame, indexed by date, holding every day from since
+            since: Optional first date (YYYY-MM-DD) the days replace, or None if they are the whole series
+
+        Returns a dictionary of:
+            rolling: Window in days to a DataFrame of rolling means of each SERIES column
+            correlations: DataFrame of Pearson correlations, one row per pair and one column per lag
+            topic: DataFrame of mood by topic (entries, mean, std and the share of each mood)
+            weather: DataFrame of mood by weather, as for topic"""
+        with self._lock:
+            first = pd.Timestamp(since) if since is not None else None
+            if first is None or not self._days:
+                self._clear()
+            else:
+                self._retract(first)
+            self._add(daily, first)
+            self._results = {
+                "rolling": {window: _join(chunks, list(SERIES)) for window, chunks in self._rolling.items()},
+                "correlations": _correlations(self._sums, self.pairs, self.lags),
+                "topic": _distribution(self._groups["topic"]),
+                "weather": _distribution(self._groups["weather"])
+            }
+            return self._results
+
+    def _clear(self):
+        self._days = []
+        self._rolling = {window: [] for window in self.windows}
+        self._sums = np.zeros_like(self._sums)
+        self._groups = {column: pd.DataFrame(columns=list(_TOTALS), dtype=float) for column in self._groups}
+
+    def _retract(self, first):
+        # Take the old days from first onwards back out of the sums, then drop them and their rolling means
+        old = self._tail(first - self.context)
+        replaced = old.loc[first:] if not old.empty else old
+        if not replaced.empty:
+            self._sums -= _lagged_sums(old, self.pairs, self.lags, first)
+            for column in self._groups:
+                self._groups[column] = _subtract(self._groups[column], _group_sums(replaced, column))
+        self._days = _truncate(self._days, first)
+        for window in self.windows:
+            self._rolling[window] = _truncate(self._rolling[window], first)
+
+    def _add(self, daily, first):
+        if daily.empty:
+            return
+        first = daily.index[0] if first is None else first
+        # Days before the new ones that a lag or rolling window reaches back to
+        combined = pd.concat([self._tail(first - self.context), daily]) if self._days else daily
+        self._sums += _lagged_sums(combined, self.pairs, self.lags, first)
+        for column in self._groups:
+            self._groups[column] = self._groups[column].add(_group_sums(daily, column), fill_value=0)
+        values = combined[list(SERIES)].apply(pd.to_numeric, errors="coerce")
+        for window in self.windows:
+            # Only the new days' rolling means are worked out, from the days they reach back to
+            self._rolling[window] = _append(self._rolling[window], values.rolling(f"{window}D").mean().loc[first:])
+        self._days = _append(self._days, daily)
+
+    def _tail(self, start):
+        """ Get the stored days from a date onwards."""
+        chunks = []
+        for chunk in reversed(self._days):
+            chunks.append(chunk)
+            if chunk.index[0] <= start:
+                break
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks[::-1]).loc[start:]
+
+
+def _append(chunks, frame):
+    """ Add a frame to a list of chunks, joining them into one when there get to be too many."""
+    if frame.empty:
+        return chunks
+    chunks = chunks + [frame]
+    if len(chunks) > _MAX_CHUNKS:
+        chunks = [pd.concat(chunks)]
+    return chunks
+
+
+def _truncate(chunks, first):
+    """ Drop the rows of a list of chunks from a date onwards."""
+    kept = []
+    for chunk in chunks:
+        if chunk.index[-1] < first:
+            kept.append(chunk)
+        elif chunk.index[0] < first:
+            kept.append(chunk.loc[:first - pd.Timedelta(days=1)])
+    return kept
+
+
+def _join(chunks, columns):
+    """ Join a list of chunks into one frame."""
+    if not chunks:
+        return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name="date"), dtype=float)
+    return chunks[0] if len(chunks) == 1 else pd.concat(chunks)
+
+
+def _lagged_sums(daily, pairs, lags, first):
+    """ Sum the terms of each lagged correlation over the pairs of days ending on or after a date.
+
+    Returns an array of shape (pairs, lags, 6) holding n and the sums of x, y, x², y² and xy."""
+    sums = np.zeros((len(pairs), len(lags), 6))
+    if daily.empty or first > daily.index[-1]:
+        return sums
+    first = max(first, daily.index[0])
+    # Missing days are filled in so a lag is always a number of days, not rows
+    start = max(first - pd.Timedelta(days=max(lags)), daily.index[0])
+    days = daily[list(SERIES)].apply(pd.to_numeric, errors="coerce").reindex(pd.date_range(start, daily.index[-1], freq="D"))
+    offset = (first - start).days
+    for i, (lead, follow) in enumerate(pairs):
+        x_all = days[lead].to_numpy(dtype=float)
+        y_all = days[follow].to_numpy(dtype=float)
+        for j, lag in enumerate(lags):
+            begin = max(offset, lag)
+            x = x_all[begin - lag:len(x_all) - lag]
+            y = y_all[begin:]
+            both = ~(np.isnan(x) | np.isnan(y))
+            x, y = x[both], y[both]
+            sums[i, j] = (len(x), x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum())
+    return sums
+
+
+def _correlations(sums, pairs, lags):
+    """ Get Pearson correlations from the lagged sums, NaN where a series does not vary."""
+    n, sx, sy, sxx, syy, sxy = np.moveaxis(sums, -1, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    r = np.where(n >= 3, np.clip(r, -1, 1), np.nan)
+    return pd.DataFrame(
+        r, index=[f"{lead} → {follow}" for lead, follow in pairs],
+        columns=pd.Index(lags, name="lag (days)")
+    )
+
+
+def _group_sums(daily, column):
+    """ Count days and sum sentiment and its square, and count each mood, for each value of a column."""
+    sentiment = pd.to_numeric(daily["sentiment"], errors="coerce").to_numpy(dtype=float)
+    scored = ~np.isnan(sentiment)
+    sentiment = np.where(scored, sentiment, 0.0)
+    mood = daily["mood"].to_numpy()
+    # Every mood the app uses gets a column, as do any others found, so no day goes uncounted
+    moods = list(MOODS) + sorted(set(daily["mood"].dropna()) - set(MOODS))
+    # One groupby over indicator columns, rather than a pivot per statistic
+    terms = pd.DataFrame(
+        {"entries": scored.astype(float), "sum": sentiment, "sumsq": sentiment * sentiment}
+        | {name: (mood == name).astype(float) for name in moods},
+        index=daily.index
+    )
+    return terms.groupby(daily[column].to_numpy(), dropna=True).sum()
+
+
+def _subtract(groups, removed):
+    """ Take sums out of the per-group sums, dropping groups left with no days."""
+    groups = groups.sub(removed, fill_value=0)
+    counts = groups.drop(columns=list(_TOTALS[1:]))
+    return groups[counts.gt(0.5).any(axis=1)]
+
+
+def _distribution(groups):
+    """ Get the entries, mean and standard deviation of sentiment, and the share of each mood, per group."""
+    moods = [name for name in MOODS if name in groups] + sorted(set(groups.columns) - set(_TOTALS) - set(MOODS))
+    entries, total, squares = (groups[column].to_numpy(dtype=float) for column in _TOTALS)
+    counts = groups[moods].to_numpy(dtype=float).round()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(entries > 0, total / entries, np.nan)
+        variance = np.where(entries > 1, (squares - entries * mean * mean) / (entries - 1), np.nan)
+        shares = counts / counts.sum(axis=1, keepdims=True)
+    result = pd.DataFrame(
+        np.column_stack([mean, np.sqrt(np.clip(variance, 0, None)), shares]),
+        index=groups.index, columns=["mean", "std"] + moods
+    )
+    result.insert(0, "entries", entries.round().astype(int))
+    return result.sort_values("entries", ascending=False)
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# Set of Python functions for re-scoring the topic and sentiment of existing entries.
+# Entries are read in pages of entry IDs and scored in batches across a pool of
+# worker processes, each loading the models once. Results are written back in
+# bulk, with a checkpoint after every page so an interrupted run can carry on.
+
+# Imports
+import os
+import json
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functions.JournalFunctions import JournalFunctions as jf
+from functions.SentimentFunctions import get_sentiment_engine, get_topic_classifier
+
+# Columns read for each entry
+PAGE_COLUMNS = "entryid, entrytext, sentiment"
+
+# Fields a backfill can score, and those scored unless others are asked for
+# (sentiment is only filled in where missing, as it is usually entered with the sliders)
+FIELDS = ("topic", "sentiment")
+DEFAULT_FIELDS = ("topic",)
+
+def _init_worker(threads):
+    """ Limit each worker process's torch threads, so the pool does not oversubscribe the CPUs."""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def score_batch(batch, fields=FIELDS):
+    """ Score a batch of entries with one topic model call, run in a worker process.
+
+    Args:
+        batch: List of (entryid, text, sentiment) tuples
+        fields: Fields to score, from FIELDS
+
+    Returns the rows to write back, and the batch's embeddings or None if topics were not scored.
+    Sentiment and mood are only set on entries without a sentiment."""
+    rows = [{"entryid": eid} for eid, _, _ in batch]
+    texts = [text or "" for _, text, _ in batch]
+    embeddings = None
+    if "topic" in fields:
+        classifier = get_topic_classifier()
+        embeddings = classifier.encode(texts)
+        for row, topic in zip(rows, classifier.classify_embeddings(embeddings)):
+            row["topic"] = topic
+    if "sentiment" in fields:
+        unscored = [i for i, (_, _, sentiment) in enumerate(batch) if sentiment is None]
+        scores = get_sentiment_engine().score_many([texts[i] for i in unscored])
+        for i, (compound, mood) in zip(unscored, scores):
+            rows[i]["sentiment"] = compound
+            rows[i]["mood"] = mood
+    return rows, embeddings
+
+
+class Backfill:
+    """ Re-score the topic of every live journal entry, and score the sentiment of those without one.
+
+    Args:
+        supabase: Supabase client instance
+        fields: Fields to score, from FIELDS
+        embeddings: Optional PgVectorIndex or LocalEmbeddingIndex to store the new embeddings in
+        checkpoint_path: Optional path to a JSON file recording progress, so a run can be resumed
+        page_size: Entries read and written per page
+        batch_size: Entries scored per model call
+        workers: Number of worker processes, 0 to score in this process"""
+    def __init__(self, supabase, fields=DEFAULT_FIELDS, embeddings=None, checkpoint_path=None,
+                 page_size=500, batch_size=64, workers=None):
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        self.supabase = supabase
+        self.fields = tuple(field for field in FIELDS if field in fields)
+        self.embeddings = embeddings if "topic" in self.fields else None
+        self.checkpoint_path = checkpoint_path
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.workers = min(4, os.cpu_count() or 1) if workers is None else workers
+
+    def run(self, restart=False, progress=print):
+        """ Score every entry after the checkpoint, writing results back a page at a time.
+
+        Args:
+            restart: Ignore any checkpoint and start from the first entry
+            progress: Function called with a progress message after each page, or None
+
+        Returns a dictionary of the entries scored, seconds taken and entries per second."""
+        checkpoint = {} if restart else self._load_checkpoint()
+        after_id = checkpoint.get("after_id")
+        done = 0
+        start = time.perf_counter()
+
+        pool = None
+        if self.workers > 0:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(threads,))
+        try:
+            page = jf.get_entry_page(self.supabase, after_id, self.page_size, PAGE_COLUMNS)
+            while page:
+                batches = [
+                    [(row["entryid"], row["entrytext"], row["sentiment"]) for row in page[i:i + self.batch_size]]
+                    for i in range(0, len(page), self.batch_size)
+                ]
+                if pool is not None:
+                    futures = [pool.submit(score_batch, batch, self.fields) for batch in batches]
+                    # Read the next page while the workers score this one
+                    next_page = jf.get_entry_page(self.supabase, page[-1]["entryid"], self.page_size, PAGE_COLUMNS)
+                    results = [future.result() for future in futures]
+                else:
+                    results = [score_batch(batch, self.fields) for batch in batches]
+                    next_page = jf.get_entry_page(self.supabase, page[-1]["entryid"], self.page_size, PAGE_COLUMNS)
+
+                self._write(results)
+                after_id = page[-1]["entryid"]
+                done += len(page)
+                self._save_checkpoint(after_id, checkpoint.get("scored", 0) + done)
+                if progress is not None:
+                    elapsed = time.perf_counter() - start
+                    progress(f"{done} entries scored up to entry {after_id}, {done / elapsed:.1f} entries/s")
+                page = next_page
+            # Finished, so the next run starts again from the first entry
+            if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = time.perf_counter() - start
+        return {"entries": done, "seconds": elapsed, "per_second": done / elapsed if elapsed else 0.0}
+
+    def _write(self, results):
+        rows = [row for batch_rows, _ in results for row in batch_rows]
+        # Rows are written in groups with the same columns, as a bulk upsert sets every column it is given
+        # to null where a row leaves it out, which would clear the sentiment of entries already scored
+        groups = {}
+        for row in rows:
+            if len(row) > 1:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            jf.update_entries(self.supabase, group, self.page_size)
+        if self.embeddings is not None:
+            self.embeddings.add_many(
+                [row["entryid"] for row in rows],
+                np.concatenate([embeddings for _, embeddings in results])
+            )
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        # A checkpoint for different fields says nothing about these, so start again
+        if tuple(checkpoint.get("fields", ())) != self.fields:
+            return {}
+        return checkpoint
+
+    def _save_checkpoint(self, after_id, scored):
+        if not self.checkpoint_path:
+            return
+        # Written to a temporary file then swapped in, so an interrupted write leaves the old checkpoint
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"fields": list(self.fields), "after_id": after_id, "scored": scored}, f)
+        os.replace(tmp, self.checkpoint_path)
@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+# Set of Python functions for caching journal entries locally.
+# The cache keeps every live entry and step count in memory and only fetches
+# rows created or modified since the last sync, optionally saving a snapshot
+# to a local SQLite file so a restarted app starts warm.
+
+# Imports
+import json
+import time
+import sqlite3
+import bisect
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functions.JournalFunctions import JournalFunctions as jf, ENTRY_COLUMNS
+
+# Rows fetched per request while syncing (Supabase returns at most 1000 by default)
+PAGE_SIZE = 1000
+
+
+class EntryCache:
+    """ Read-through cache of journal entries and steps with incremental sync.
+
+    Args:
+        supabase: Supabase client instance
+        snapshot_path: Optional path to a SQLite file to persist the cache to
+        refresh_interval: Seconds before a read checks the database for changes made elsewhere
+        overlap: Seconds of history re-fetched on each sync to allow for clock differences"""
+    def __init__(self, supabase, snapshot_path=None, refresh_interval=60, overlap=5):
+        self.supabase = supabase
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.overlap = timedelta(seconds=overlap)
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._order = None
+        self._dates = None
+        self._steps = {}
+        self._entry_watermark = None
+        self._step_watermark = None
+        self._last_sync = None
+        self._stale = True
+        # Incremented on every sync that changes something, with the earliest date each one changed
+        self.version = 0
+        self._changes = deque(maxlen=256)
+        if snapshot_path:
+            self._load_snapshot()
+
+    # -----------------------------------------------------------------
+    # Reads
+    # -----------------------------------------------------------------
+
+    def get_entries(self, limit=None, before_date=None, since_date=None):
+        """ Get list of journal entries with associated steps for that day, newest first.
+
+        Args:
+            limit: Optional maximum number of entries to return
+            before_date: Optional date (YYYY-MM-DD), only entries before it are returned
+            since_date: Optional date (YYYY-MM-DD), only entries on or after it are returned"""
+        self.sync()
+        with self._lock:
+            self._sort()
+            end = len(self._order) if before_date is None else bisect.bisect_left(self._dates, str(before_date))
+            start = 0 if limit is None else max(0, end - limit)
+            if since_date is not None:
+                start = max(start, bisect.bisect_left(self._dates, str(since_date)))
+            entries = reversed(self._order[start:end])
+            return [dict(e, steps=self._steps.get(e["entrydate"], {}).get("steps")) for e in entries]
+
+    def entry_exist(self, entry_date):
+        """ Check if a journal entry exists for a given date.
+
+        Args:
+            entry_date: Date to check for existing journal entry (YYYY-MM-DD)"""
+        self.sync()
+        with self._lock:
+            self._sort()
+            i = bisect.bisect_left(self._dates, str(entry_date))
+            return i < len(self._dates) and self._dates[i] == str(entry_date)
+
+    def changed_since(self, version):
+        """ Get the cache's version and the earliest entry or step date changed since an earlier version.
+
+        Lets something derived from the entries, e.g. Analytics, update only the days that changed.
+
+        Args:
+            version: Version returned by an earlier call, or None
+
+        Returns the current version and the earliest changed date (YYYY-MM-DD), None if nothing
+        changed, or "" if everything should be treated as changed."""
+        with self._lock:
+            if version == self.version:
+                return self.version, None
+            # Versions before the oldest one remembered could have changed any day
+            if version is None or version > self.version or not self._changes or version < self._changes[0][0] - 1:
+                return self.version, ""
+            return self.version, min(date for v, date in self._changes if v > version)
+
+    def _sort(self):
+        # Entries are kept sorted oldest first, so a page is a slice found by binary search
+        if self._order is None:
+            self._order = sorted(self._entries.values(), key=lambda e: (e["entrydate"], e["entryid"]))
+            self._dates = [e["entrydate"] for e in self._order]
+
+    # -----------------------------------------------------------------
+    # Writes, passed through to the database then synced back
+    # -----------------------------------------------------------------
+
+    def add_entry(self, entry_date, text, sentiment, mood, weather, temperature, topic, image_path=None, image_thumbs=None, image_hash=None):
+        """ Add a new journal entry and return its entryid. See JournalFunctions.add_entry."""
+        eid = jf.add_entry(self.supabase, entry_date, text, sentiment, mood, weather, temperature, topic, image_path, image_thumbs, image_hash)
+        self.invalidate()
+        return eid
+
+    def update_entry(self, eid, text, sentiment, mood, weather, temperature, topic, image_path=None, image_thumbs=None, image_hash=None):
+        """ Update an existing journal entry. See JournalFunctions.update_entry."""
+        jf.update_entry(self.supabase, eid, text, sentiment, mood, weather, temperature, topic, image_path, image_thumbs, image_hash)
+        self.invalidate()
+        return True
+
+    def delete_entry(self, eid):
+        """ Soft delete a journal entry. See JournalFunctions.delete_entry."""
+        jf.delete_entry(self.supabase, eid)
+        with self._lock:
+            self._entries.pop(eid, None)
+            self._order = None
+        self.invalidate()
+        return True
+
+    def add_steps(self, step_date, steps):
+        """ Add step count data for a specific date. See JournalFunctions.add_steps."""
+        jf.add_steps(self.supabase, step_date, steps)
+        self.invalidate()
+
+    def invalidate(self, eid=None):
+        """ Mark the cache as needing a sync before the next read.
+
+        Only rows changed since the last sync are fetched, so this is cheap.
+
+        Args:
+            eid: Optional entry ID that changed, accepted so this can be used as a callback"""
+        with self._lock:
+            self._stale = True
+
+    # -----------------------------------------------------------------
+    # Sync
+    # -----------------------------------------------------------------
+
+    def sync(self, force=False):
+        """ Fetch entries and steps created, modified or deleted since the last sync.
+
+        Args:
+            force: Sync even if the cache is fresh"""
+        with self._lock:
+            fresh = (
+                not self._stale
+                and self._last_sync is not None
+                and time.monotonic() - self._last_sync < self.refresh_interval
+            )
+            if fresh and not force:
+                return False
+
+            dates = self._sync_entries() + self._sync_steps()
+            changed = bool(dates)
+            if dates:
+                self.version += 1
+                self._changes.append((self.version, min(dates)))
+            self._stale = False
+            self._last_sync = time.monotonic()
+            if changed and self.snapshot_path:
+                self._save_snapshot()
+            return True
+
+    def _changed_rows(self, table, key, watermark, columns="*"):
+        # Paged on the table's key until an empty page, as the API caps how many rows one request returns
+        since = _comparable(watermark - self.overlap).isoformat(sep=" ") if watermark is not None else None
+        rows, last = [], None
+        while True:
+            query = self.supabase.table(table).select(columns).order(key).limit(PAGE_SIZE)
+            if since is not None:
+                query = query.or_(f'datecreated.gt."{since}",datemodified.gt."{since}"')
+            if last is not None:
+                query = query.gt(key, last)
+            page = query.execute().data
+            if not page:
+                return rows
+            rows.extend(page)
+            last = page[-1][key]
+
+    def _sync_entries(self):
+        rows = self._changed_rows("entry", "entryid", self._entry_watermark, ENTRY_COLUMNS)
+        dates = []
+        for row in rows:
+            # Rows re-fetched by the overlap but unchanged are not counted as changes
+            previous = self._entries.get(row["entryid"])
+            if previous != row and not (previous is None and row.get("datedeleted")):
+                # The date the entry had before is changed too, if it has moved
+                if previous is not None:
+                    dates.append(str(previous["entrydate"])[:10])
+                dates.append(str(row["entrydate"])[:10])
+            if row.get("datedeleted"):
+                self._entries.pop(row["entryid"], None)
+            else:
+                self._entries[row["entryid"]] = row
+            self._entry_watermark = _latest(self._entry_watermark, row)
+        if rows:
+            self._order = None
+        return dates
+
+    def _sync_steps(self):
+        rows = self._changed_rows("step", "stepid", self._step_watermark)
+        dates = []
+        for row in rows:
+            current = self._steps.get(row["stepdate"])
+            if row.get("datedeleted"):
+                if current and current["stepid"] == row["stepid"]:
+                    self._steps.pop(row["stepdate"])
+                    dates.append(str(row["stepdate"])[:10])
+            elif current is None or row["stepid"] >= current["stepid"]:
+                # Keep the most recent count recorded for each day, as the entry_with_steps view does
+                step = {"stepid": row["stepid"], "steps": row["steps"]}
+                if step != current:
+                    dates.append(str(row["stepdate"])[:10])
+                self._steps[row["stepdate"]] = step
+            self._step_watermark = _latest(self._step_watermark, row)
+        return dates
+
+    # -----------------------------------------------------------------
+    # Snapshot
+    # -----------------------------------------------------------------
+
+    def _connect(self):
+        conn = sqlite3.connect(self.snapshot_path)
+        conn.execute("create table if not exists cache_entry (entryid integer primary key, row text)")
+        conn.execute("create table if not exists cache_step (stepdate text primary key, stepid integer, steps integer)")
+        conn.execute("create table if not exists cache_meta (key text primary key, value text)")
+        return conn
+
+    def _load_snapshot(self):
+        with self._connect() as conn:
+            self._entries = {eid: json.loads(row) for eid, row in conn.execute("select entryid, row from cache_entry")}
+            self._steps = {
+                stepdate: {"stepid": stepid, "steps": steps}
+                for stepdate, stepid, steps in conn.execute("select stepdate, stepid, steps from cache_step")
+            }
+            meta = dict(conn.execute("select key, value from cache_meta"))
+        self._entry_watermark = _parse_time(meta.get("entry_watermark"))
+        self._step_watermark = _parse_time(meta.get("step_watermark"))
+        conn.close()
+
+    def _save_snapshot(self):
+        with self._connect() as conn:
+            conn.execute("delete from cache_entry")
+            conn.executemany(
+                "insert into cache_entry (entryid, row) values (?, ?)",
+                [(eid, json.dumps(row)) for eid, row in self._entries.items()]
+            )
+            conn.execute("delete from cache_step")
+            conn.executemany(
+                "insert into cache_step (stepdate, stepid, steps) values (?, ?, ?)",
+                [(stepdate, s["stepid"], s["steps"]) for stepdate, s in self._steps.items()]
+            )
+            conn.executemany(
+                "insert or replace into cache_meta (key, value) values (?, ?)",
+                [
+                    ("entry_watermark", self._entry_watermark.isoformat() if self._entry_watermark else None),
+                    ("step_watermark", self._step_watermark.isoformat() if self._step_watermark else None)
+                ]
+            )
+        conn.close()
+
+
+def _parse_time(value):
+    """ Parse a timestamp returned by the database, or None."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def _latest(watermark, row):
+    """ Get the later of the watermark and the row's created and modified times."""
+    for key in ("datecreated", "datemodified"):
+        stamp = _parse_time(row.get(key))
+        if stamp is not None and (watermark is None or _comparable(stamp) > _comparable(watermark)):
+            watermark = stamp
+    return watermark
+
+
+def _comparable(stamp):
+    """ Convert a timestamp to UTC so timestamps with and without offsets can be compared.
+
+    Timestamps are written in UTC (see JournalFunctions.utc_now), and SQLite's datetime('now')
+    default is UTC too, so a timestamp without an offset is taken to be UTC."""
+    return stamp.replace(tzinfo=timezone.utc) if stamp.tzinfo is None else stamp.astimezone(timezone.utc)
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# Set of Python functions for drawing the Statistics page charts.
+# Series are computed in one pass and rendered charts are cached as PNG bytes
+# keyed on a hash of the data, so a repeat view does not redraw anything.
+
+# Imports
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+from matplotlib.figure import Figure
+
+# Series plotted on the Statistics page, with their label and colour
+SERIES = {
+    "sentiment": ("Mood", "#4A2E54"),
+    "temperature": ("Temperature", "#7B3357"),
+    "steps": ("Steps", "#E2A9C2")
+}
+
+# Rendered charts, most recently used last
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+_CHART_CACHE_SIZE = 16
+
+
+class ChartFunctions:
+    @staticmethod
+    def period_series(df, date_col="entrydate"):
+        """ Average sentiment, temperature and steps per date in a single groupby.
+
+        Args:
+            df: DataFrame with a date column and sentiment, temperature and steps columns
+            date_col: Name of the date column to group by"""
+        values = df[list(SERIES)].apply(pd.to_numeric, errors="coerce")
+        dates = pd.to_datetime(df[date_col]).dt.date.rename("date")
+        return values.groupby(dates).agg({column: "mean" for column in SERIES}).sort_index()
+
+    def normalise(frame):
+        """ Min-max normalise every column of a DataFrame to between 0 and 1.
+
+        Args:
+            frame: DataFrame of numeric columns"""
+        low = frame.min()
+        span = frame.max() - low
+        return (frame - low) / span.where(span != 0)
+
+    def data_version(frame):
+        """ Hash the contents of a DataFrame, to use as a cache key for anything derived from it.
+
+        Args:
+            frame: DataFrame to hash"""
+        hashed = pd.util.hash_pandas_object(frame, index=True).values
+        return hashlib.sha1(hashed.tobytes() + ",".join(map(str, frame.columns)).encode()).hexdigest()
+
+    def render_charts(series, fmt="png"):
+        """ Render the combined and individual Statistics charts, reusing earlier renders of the same data.
+
+        Args:
+            series: DataFrame from period_series, indexed by date
+            fmt: Image format to render, "png" or "svg"
+
+        Returns a dictionary of chart name ("combined" or a SERIES column) to image bytes."""
+        key = (ChartFunctions.data_version(series), fmt)
+        with _chart_cache_lock:
+            if key in _chart_cache:
+                _chart_cache.move_to_end(key)
+                return _chart_cache[key]
+
+        charts = {"combined": _render_combined(ChartFunctions.normalise(series), fmt)}
+        for column in SERIES:
+            charts[column] = _render_single(series[column], column, fmt)
+
+        with _chart_cache_lock:
+            _chart_cache[key] = charts
+            while len(_chart_cache) > _CHART_CACHE_SIZE:
+                _chart_cache.popitem(last=False)
+        return charts
+
+
+def _render_combined(normalised, fmt):
+    """ Draw every series on one set of axes."""
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    for column, (label, color) in SERIES.items():
+        ax.plot(normalised.index, normalised[column].values, marker="o", color=color, label=label)
+    ax.set_ylabel("Normalised Value (0-1)")
+    ax.set_xlabel("Date")
+    ax.set_title("Trends Over Time")
+    ax.legend()
+    return _to_bytes(fig, ax, fmt)
+
+
+def _render_single(values, column, fmt):
+    """ Draw one series on its own axes."""
+    label, color = SERIES[column]
+    fig = Figure(figsize=(10, 3))
+    ax = fig.subplots()
+    ax.plot(values.index, values.values, marker="o", color=color)
+    ax.set_xlabel("Date")
+    # Limits are padded around the data, unless there is none yet (e.g. no steps or weather recorded)
+    known = values.dropna()
+    if column == "sentiment":
+        ax.set_ylabel("Average Mood")
+        ax.set_ylim(-1, 1)
+    elif column == "temperature":
+        ax.set_ylabel("Average Temperature (°C)")
+        if not known.empty:
+            ax.set_ylim(known.min() - 5, known.max() + 5)
+    else:
+        ax.set_ylabel("Average Steps")
+        if not known.empty:
+            ax.set_ylim(known.min() - 500, known.max() + 500)
+    return _to_bytes(fig, ax, fmt)
+
+
+def _to_bytes(fig, ax, fmt):
+    """ Finish a chart, save it to bytes and release the figure."""
+    ax.grid(True)
+    ax.tick_params(axis="x", labelrotation=90)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    fig.clear()
+    return buffer.getvalue()
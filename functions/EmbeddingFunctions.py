@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# Set of Python functions for storing entry embeddings and finding similar entries.
+# Embeddings are the unit-length MiniLM vectors computed when an entry's topic is
+# identified, stored once per write either in a pgvector column in Supabase or in
+# a local NumPy matrix, so a similarity search never re-encodes the journal.
+
+# Imports
+import os
+import threading
+from pathlib import Path
+import numpy as np
+from functions.JournalFunctions import JournalFunctions as jf
+from functions.SentimentFunctions import get_topic_classifier
+
+
+class PgVectorIndex:
+    """ Entry embeddings stored in the entry.embedding pgvector column, searched with the match_entries function.
+
+    Args:
+        supabase: Supabase client instance"""
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def add(self, eid, embedding):
+        """ Store the embedding of an entry.
+
+        Args:
+            eid: Entry ID of the journal entry
+            embedding: Unit-length embedding vector"""
+        jf.set_embedding(self.supabase, eid, [float(x) for x in embedding])
+
+    def add_many(self, eids, embeddings):
+        """ Store the embeddings of many entries in batched updates.
+
+        Args:
+            eids: Entry IDs of the journal entries
+            embeddings: Matrix of unit-length embeddings, one row per entry"""
+        jf.update_entries(self.supabase, [
+            {"entryid": int(eid), "embedding": [float(x) for x in embedding]}
+            for eid, embedding in zip(eids, embeddings)
+        ])
+
+    def remove(self, eid):
+        """ Nothing to do, as match_entries already leaves out soft-deleted entries.
+
+        Args:
+            eid: Entry ID of the journal entry"""
+        return None
+
+    def get(self, eid):
+        """ Get the stored embedding of an entry, or None if it has none.
+
+        Args:
+            eid: Entry ID of the journal entry"""
+        return jf.get_embedding(self.supabase, eid)
+
+    def search(self, embedding, k=5, exclude_id=None):
+        """ Get the k entries most similar to an embedding, as (entryid, similarity) pairs.
+
+        Args:
+            embedding: Unit-length embedding vector to compare against
+            k: Number of entries to return
+            exclude_id: Optional entry ID to leave out, e.g. the entry being compared"""
+        rows = jf.match_entries(self.supabase, [float(x) for x in embedding], k, exclude_id)
+        return [(row["entryid"], row["similarity"]) for row in rows]
+
+
+class LocalEmbeddingIndex:
+    """ Entry embeddings kept in a NumPy matrix, memory-mapped from disk and searched with one matrix product.
+
+    Args:
+        path: Optional directory to save the matrix and entry IDs to
+        dim: Number of dimensions of each embedding"""
+    def __init__(self, path=None, dim=384):
+        self.path = Path(path) if path else None
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        if self.path and (self.path / "embeddings.npy").exists():
+            self._matrix = np.load(self.path / "embeddings.npy", mmap_mode="r")
+            self._ids = np.load(self.path / "ids.npy")
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, eid, embedding):
+        """ Store or replace the embedding of an entry.
+
+        Args:
+            eid: Entry ID of the journal entry
+            embedding: Unit-length embedding vector"""
+        self.add_many([eid], np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+
+    def add_many(self, eids, embeddings):
+        """ Store or replace the embeddings of many entries at once.
+
+        Args:
+            eids: Entry IDs of the journal entries
+            embeddings: Matrix of unit-length embeddings, one row per entry"""
+        eids = np.asarray(eids, dtype=np.int64)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            keep = ~np.isin(self._ids, eids)
+            self._ids = np.concatenate([self._ids[keep], eids])
+            self._matrix = np.concatenate([self._matrix[keep], embeddings])
+            if self.path:
+                self._save()
+
+    def remove(self, eid):
+        """ Remove the embedding of an entry, e.g. when it is deleted.
+
+        Args:
+            eid: Entry ID of the journal entry"""
+        with self._lock:
+            keep = self._ids != eid
+            self._ids = self._ids[keep]
+            self._matrix = self._matrix[keep]
+            if self.path:
+                self._save()
+
+    def get(self, eid):
+        """ Get the stored embedding of an entry, or None if it has none.
+
+        Args:
+            eid: Entry ID of the journal entry"""
+        with self._lock:
+            rows = np.flatnonzero(self._ids == eid)
+            return np.array(self._matrix[rows[0]]) if len(rows) else None
+
+    def search(self, embedding, k=5, exclude_id=None):
+        """ Get the k entries most similar to an embedding, as (entryid, similarity) pairs.
+
+        Args:
+            embedding: Unit-length embedding vector to compare against
+            k: Number of entries to return
+            exclude_id: Optional entry ID to leave out, e.g. the entry being compared"""
+        with self._lock:
+            ids, matrix = self._ids, self._matrix
+        if not len(ids):
+            return []
+        # Embeddings are unit length, so the dot product is the cosine similarity
+        sims = matrix @ np.asarray(embedding, dtype=np.float32)
+        if exclude_id is not None:
+            sims = np.where(ids == exclude_id, -np.inf, sims)
+        k = min(k, len(ids) - (exclude_id in ids))
+        if k <= 0:
+            return []
+        # Partial sort for the top k, then order just those
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(int(ids[i]), float(sims[i])) for i in top]
+
+    def _save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Write to temporary files then swap them in, so searches reading the old mapping are unaffected
+        for name, array in (("ids.npy", self._ids), ("embeddings.npy", np.asarray(self._matrix))):
+            with open(self.path / f"{name}.tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(self.path / f"{name}.tmp", self.path / name)
+        self._matrix = np.load(self.path / "embeddings.npy", mmap_mode="r")
+
+
+def find_similar(index, entry_id=None, text=None, k=5):
+    """ Find the entries most similar to an existing entry or to some text.
+
+    An existing entry uses its stored embedding, so only free text is encoded.
+
+    Args:
+        index: PgVectorIndex or LocalEmbeddingIndex holding the entry embeddings
+        entry_id: Entry ID of the journal entry to compare against
+        text: Text to compare against, used if entry_id is not given
+        k: Number of entries to return
+
+    Returns a list of (entryid, similarity) pairs, most similar first."""
+    if entry_id is not None:
+        embedding = index.get(entry_id)
+        if embedding is None:
+            return []
+    elif text and text.strip():
+        embedding = get_topic_classifier().encode([text])[0]
+    else:
+        raise ValueError("Either entry_id or text is required")
+    return index.search(embedding, k, exclude_id=entry_id)
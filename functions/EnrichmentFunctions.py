@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+# Set of Python functions for enriching journal entries in the background.
+# Entries are saved straight away and the slower topic, sentiment and weather
+# lookups are filled in afterwards by a worker thread pool.
+
+# Imports
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functions.JournalFunctions import JournalFunctions as jf
+from functions.SentimentFunctions import SentimentFunctions as sf
+from functions.WeatherFunctions import WeatherFunctions as wth
+
+# Enrichment states reported for an entry
+PENDING = "pending"
+FAILED = "failed"
+
+
+class EnrichmentWorker:
+    """ Queue topic, sentiment and weather enrichment of saved entries.
+
+    Args:
+        supabase: Supabase client instance
+        lat: Latitude used for the weather lookup
+        lon: Longitude used for the weather lookup
+        weather_api_key: API key for OpenWeatherMap https://openweathermap.org/
+        max_workers: Number of worker threads
+        max_attempts: Number of times to try an entry before marking it failed
+        retry_delay: Seconds to wait before the first retry, doubled on each retry
+        on_done: Optional callback called with the entry ID once an entry is enriched
+        embeddings: Optional PgVectorIndex or LocalEmbeddingIndex to store each entry's embedding in"""
+    def __init__(self, supabase, lat, lon, weather_api_key, max_workers=2, max_attempts=3, retry_delay=2.0, on_done=None, embeddings=None):
+        self.supabase = supabase
+        self.lat = lat
+        self.lon = lon
+        self.weather_api_key = weather_api_key
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.on_done = on_done
+        self.embeddings = embeddings
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="enrichment")
+        self._lock = threading.Lock()
+        self._states = {}
+        self._errors = {}
+        self._jobs = {}
+
+    def submit(self, eid, text, sentiment=False):
+        """ Queue an entry for enrichment and return the future for the job.
+
+        Args:
+            eid: Entry ID of the saved journal entry
+            text: Text content of the journal entry
+            sentiment: Whether to also detect sentiment and mood from the text"""
+        with self._lock:
+            self._states[eid] = PENDING
+            self._errors.pop(eid, None)
+            self._jobs[eid] = (text, sentiment)
+        return self._executor.submit(self._run, eid, text, sentiment)
+
+    def status(self, eid):
+        """ Get the enrichment state of an entry, or None if it is not queued.
+
+        Args:
+            eid: Entry ID of the journal entry"""
+        with self._lock:
+            return self._states.get(eid)
+
+    def error(self, eid):
+        """ Get the last error raised while enriching an entry, if any.
+
+        Args:
+            eid: Entry ID of the journal entry"""
+        with self._lock:
+            return self._errors.get(eid)
+
+    def pending(self):
+        """ Get the entry IDs still waiting to be enriched."""
+        with self._lock:
+            return [eid for eid, state in self._states.items() if state == PENDING]
+
+    def failed(self):
+        """ Get the entry IDs that could not be enriched."""
+        with self._lock:
+            return [eid for eid, state in self._states.items() if state == FAILED]
+
+    def retry_failed(self):
+        """ Queue every failed entry for another round of attempts."""
+        with self._lock:
+            jobs = [(eid, self._jobs[eid]) for eid, state in self._states.items() if state == FAILED]
+        for eid, (text, sentiment) in jobs:
+            self.submit(eid, text, sentiment)
+        return len(jobs)
+
+    def resume(self, sentiment=False, chunk_size=500):
+        """ Queue every saved entry still missing its topic, or today's weather, that is not already queued.
+
+        Jobs are only held in memory, so this picks up entries left unfinished when the app last stopped.
+
+        Args:
+            sentiment: Whether to also detect sentiment and mood, for entries that have none
+            chunk_size: Entries read at a time
+
+        Returns the number of entries queued."""
+        queued = 0
+        after_id = None
+        while True:
+            rows = jf.get_unenriched_entries(self.supabase, after_id=after_id, limit=chunk_size)
+            if not rows:
+                return queued
+            for row in rows:
+                if (row["topic"] is None or row["weather"] is None) and self.status(row["entryid"]) is None:
+                    self.submit(row["entryid"], row["entrytext"], sentiment=sentiment and row["sentiment"] is None)
+                    queued += 1
+            after_id = rows[-1]["entryid"]
+
+    def shutdown(self, wait=True):
+        """ Stop accepting work, optionally waiting for queued entries to finish.
+
+        Args:
+            wait: Whether to block until the queue is drained"""
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, eid, text, sentiment):
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._enrich(eid, text, sentiment)
+            except Exception as e:
+                with self._lock:
+                    self._errors[eid] = e
+                if attempt == self.max_attempts:
+                    with self._lock:
+                        self._states[eid] = FAILED
+                    return False
+                time.sleep(delay)
+                delay *= 2
+            else:
+                with self._lock:
+                    self._states.pop(eid, None)
+                    self._errors.pop(eid, None)
+                    self._jobs.pop(eid, None)
+                if self.on_done is not None:
+                    self.on_done(eid)
+                return True
+
+    def _enrich(self, eid, text, sentiment):
+        entry = jf.get_entry(self.supabase, eid, "entryid, entrydate, entrytext, weather, temperature, datemodified, datedeleted")
+        # Entries deleted, or edited (and so enriched by the edit) since they were queued, are left as they are
+        if entry is None or entry["datedeleted"] or entry["entrytext"] != text:
+            return
+        # Only today's entries are given the current weather, earlier ones keep any they have
+        temperature, weather = wth.get_weather_for_entry(entry, self.lat, self.lon, self.weather_api_key)
+        topic, embedding = sf.get_topic_and_embedding(text)
+        compound, mood = sf.get_sentiment(text) if sentiment else (None, None)
+        if not jf.enrich_entry(self.supabase, eid, weather, temperature, topic, compound, mood, modified=entry):
+            return
+        if self.embeddings is not None:
+            self.embeddings.add(eid, embedding)
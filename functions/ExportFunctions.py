@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+# Set of Python functions for exporting and importing the whole journal as Parquet.
+# Tables are streamed a chunk at a time in both directions, so memory use stays
+# the same however long the journal is, and the files load straight into pandas.
+# https://arrow.apache.org/docs/python/parquet.html
+
+# Imports
+import json
+import mimetypes
+from datetime import date
+from pathlib import Path
+from functions.ImageFunctions import ImageFunctions as imf, BUCKET
+from functions.JournalFunctions import utc_now
+
+# Files written to an export directory
+ENTRY_FILE = "entry.parquet"
+STEP_FILE = "step.parquet"
+IMAGE_FILE = "images.parquet"
+IMAGE_DIR = "images"
+
+# Columns exported from each table, with their Parquet types
+# (timestamps are kept as the text the database returns, so they round trip unchanged)
+ENTRY_FIELDS = [
+    ("entryid", "int64"), ("entrydate", "date32"), ("entrytext", "string"), ("topic", "string"),
+    ("sentiment", "float64"), ("mood", "string"), ("weather", "string"), ("temperature", "float64"),
+    ("imagepath", "string"), ("imagethumbs", "string"), ("imagehash", "string"),
+    ("datecreated", "string"), ("datemodified", "string"), ("datedeleted", "string")
+]
+STEP_FIELDS = [
+    ("stepid", "int64"), ("stepdate", "date32"), ("steps", "int64"),
+    ("datecreated", "string"), ("datemodified", "string"), ("datedeleted", "string")
+]
+IMAGE_FIELDS = [("imagepath", "string"), ("imagethumbs", "string"), ("imagehash", "string"), ("included", "bool")]
+
+
+class ExportFunctions:
+    @staticmethod
+    def export_journal(supabase, path, chunk_size=1000, images=False):
+        """ Export every entry and step count to Parquet files in a directory.
+
+        Also writes a manifest of the images used by the entries, and with images=True
+        downloads each image and its thumbnails alongside, one file at a time.
+
+        Args:
+            supabase: Supabase client instance
+            path: Directory to write entry.parquet, step.parquet and images.parquet to
+            chunk_size: Rows fetched and written at a time
+            images: Whether to download the image files as well as listing them
+
+        Returns a dictionary of the number of rows written for each file.
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        entry_schema, step_schema, image_schema = (_schema(f) for f in (ENTRY_FIELDS, STEP_FIELDS, IMAGE_FIELDS))
+        counts = {"entry": 0, "step": 0, "images": 0}
+
+        # Each chunk becomes a row group, so only one chunk is held in memory
+        seen = set()
+        with pq.ParquetWriter(path / ENTRY_FILE, entry_schema) as entries, pq.ParquetWriter(path / IMAGE_FILE, image_schema) as manifest:
+            for rows in _pages(supabase, "entry", [name for name, _ in ENTRY_FIELDS], "entryid", chunk_size):
+                entries.write_table(pa.Table.from_pylist([_to_arrow(row) for row in rows], entry_schema))
+                counts["entry"] += len(rows)
+
+                listed = []
+                for row in rows:
+                    if row.get("imagepath") and row["imagepath"] not in seen:
+                        seen.add(row["imagepath"])
+                        included = images and _download_image(supabase, path / IMAGE_DIR, row)
+                        listed.append(_to_arrow(dict(row, included=bool(included))))
+                if listed:
+                    manifest.write_table(pa.Table.from_pylist(listed, image_schema))
+                    counts["images"] += len(listed)
+
+        with pq.ParquetWriter(path / STEP_FILE, step_schema) as steps:
+            for rows in _pages(supabase, "step", [name for name, _ in STEP_FIELDS], "stepid", chunk_size):
+                steps.write_table(pa.Table.from_pylist([_to_arrow(row) for row in rows], step_schema))
+                counts["step"] += len(rows)
+        return counts
+
+    def import_journal(supabase, path, chunk_size=1000, keep_ids=False, images=True):
+        """ Load entries and step counts from an export into the database in batched writes.
+
+        By default entries get new IDs and any for a date already in the journal are skipped,
+        so history can be loaded into a fresh or partly filled database and an import can be
+        re-run. With keep_ids=True entries are upserted under their exported IDs, soft-deleted
+        ones included (on Postgres, afterwards run:
+        select setval('entry_entryid_seq', (select max(entryid) from entry));).
+        Step counts are upserted on their date. Imported rows keep their datecreated but get the
+        import time as datemodified, so a running app's EntryCache (and its snapshot) picks
+        them up on its next sync.
+
+        Args:
+            supabase: Supabase client instance
+            path: Directory written by export_journal
+            chunk_size: Rows read and written at a time
+            keep_ids: Whether to keep the exported entry IDs
+            images: Whether to upload exported image files that are not already stored
+
+        Returns a dictionary of the number of rows written for each file.
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        path = Path(path)
+        counts = {"entry": 0, "step": 0, "images": 0}
+        now = utc_now()
+
+        existing = set()
+        if not keep_ids:
+            for rows in _pages(supabase, "entry", ["entryid", "entrydate", "datedeleted"], "entryid", chunk_size):
+                existing.update(str(row["entrydate"])[:10] for row in rows if not row.get("datedeleted"))
+
+        for rows in _read(path / ENTRY_FILE, chunk_size):
+            rows = [dict(row, datemodified=now) for row in rows]
+            if keep_ids:
+                supabase.table("entry").upsert(rows, on_conflict="entryid").execute()
+            else:
+                rows = [
+                    {k: v for k, v in row.items() if k != "entryid"}
+                    for row in rows
+                    if not row["datedeleted"] and row["entrydate"] not in existing
+                ]
+                if rows:
+                    supabase.table("entry").insert(rows).execute()
+                existing.update(row["entrydate"] for row in rows)
+            counts["entry"] += len(rows)
+
+        for rows in _read(path / STEP_FILE, chunk_size):
+            rows = [dict({k: v for k, v in row.items() if k != "stepid"}, datemodified=now) for row in rows]
+            supabase.table("step").upsert(rows, on_conflict="stepdate").execute()
+            counts["step"] += len(rows)
+
+        if images and (path / IMAGE_FILE).exists():
+            for rows in _read(path / IMAGE_FILE, chunk_size):
+                for row in rows:
+                    if row["included"]:
+                        counts["images"] += _upload_image(supabase, path / IMAGE_DIR, row)
+        return counts
+
+    def read_entries(path):
+        """ Load live entries from an export into a DataFrame, with the steps recorded for each day.
+
+        Gives the same columns as the entry_with_steps view, so it can be passed straight
+        to ChartFunctions.period_series without building a DataFrame from rows.
+
+        Args:
+            path: Directory written by export_journal"""
+        import pandas as pd
+        path = Path(path)
+        entries = pd.read_parquet(path / ENTRY_FILE)
+        entries = entries[entries["datedeleted"].isna()]
+        steps = pd.read_parquet(path / STEP_FILE, columns=["stepid", "stepdate", "steps", "datedeleted"])
+        # Keep the most recent count recorded for each day, as the entry_with_steps view does
+        steps = steps[steps["datedeleted"].isna()].sort_values("stepid").drop_duplicates("stepdate", keep="last")
+        return entries.merge(
+            steps[["stepdate", "steps"]], how="left", left_on="entrydate", right_on="stepdate"
+        ).drop(columns="stepdate")
+
+
+def _schema(fields):
+    """ Build a pyarrow schema from (name, type name) pairs."""
+    import pyarrow as pa
+    types = {
+        "int64": pa.int64(), "float64": pa.float64(), "string": pa.string(),
+        "date32": pa.date32(), "bool": pa.bool_()
+    }
+    return pa.schema([(name, types[kind]) for name, kind in fields])
+
+
+def _pages(supabase, table, columns, key, chunk_size):
+    """ Yield every row of a table a chunk at a time, paging on its key column."""
+    last = None
+    while True:
+        query = supabase.table(table).select(", ".join(columns)).order(key).limit(chunk_size)
+        if last is not None:
+            query = query.gt(key, last)
+        rows = query.execute().data
+        # Stop on an empty page rather than a short one, as the API may cap the page size
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][key]
+
+
+def _read(file, chunk_size):
+    """ Yield the rows of a Parquet file a chunk at a time, as dictionaries ready to write."""
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size):
+        yield [_from_arrow(row) for row in batch.to_pylist()]
+
+
+def _to_arrow(row):
+    """ Convert a row from the database to Parquet values: dates as dates and thumbnails as JSON text."""
+    row = dict(row)
+    for column in ("entrydate", "stepdate"):
+        if row.get(column):
+            row[column] = date.fromisoformat(str(row[column])[:10])
+    if isinstance(row.get("imagethumbs"), dict):
+        row["imagethumbs"] = json.dumps(row["imagethumbs"])
+    return row
+
+
+def _from_arrow(row):
+    """ Convert a row read from Parquet back to database values."""
+    for column in ("entrydate", "stepdate"):
+        if isinstance(row.get(column), date):
+            row[column] = row[column].isoformat()
+    if isinstance(row.get("imagethumbs"), str):
+        row["imagethumbs"] = json.loads(row["imagethumbs"])
+    return row
+
+
+def _image_files(row):
+    """ Get the storage paths of an image and its thumbnails."""
+    thumbs = row.get("imagethumbs") or {}
+    if isinstance(thumbs, str):
+        thumbs = json.loads(thumbs)
+    return [row["imagepath"]] + list(thumbs.values())
+
+
+def _download_image(supabase, directory, row):
+    """ Download an image and its thumbnails into the export, returning whether the original was found."""
+    bucket = supabase.storage.from_(BUCKET)
+    found = False
+    for name in _image_files(row):
+        try:
+            data = bucket.download(name)
+        except Exception:
+            continue
+        target = directory / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        found = found or name == row["imagepath"]
+    return found
+
+
+def _upload_image(supabase, directory, row):
+    """ Upload an exported image and its thumbnails if not already stored, returning 1 if uploaded."""
+    if imf.image_exists(supabase, row["imagepath"]):
+        return 0
+    bucket = supabase.storage.from_(BUCKET)
+    # Thumbnails first, so a stored original always has its thumbnails
+    for name in reversed(_image_files(row)):
+        source = directory / name
+        if source.exists():
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            bucket.upload(name, source.read_bytes(), file_options={"content-type": content_type, "upsert": "true"})
+    return 1
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# Set of Python functions for serving journal images from Supabase storage.
+# https://supabase.com/docs/guides/storage
+
+# Imports
+import io
+import os
+import time
+import hashlib
+import threading
+from functions.JournalFunctions import JournalFunctions as jf
+
+# Storage bucket holding the journal images
+BUCKET = "journal-images"
+# Widths (px) of the thumbnails stored alongside each uploaded image
+THUMBNAIL_WIDTHS = (150, 300)
+
+
+class ImageFunctions:
+    @staticmethod
+    def make_thumbnails(data, widths=THUMBNAIL_WIDTHS, quality=80):
+        """ Create WebP thumbnails of an image at fixed widths.
+
+        Args:
+            data: Bytes of the original image
+            widths: Widths (px) to create thumbnails at
+            quality: WebP quality (0-100)
+
+        Returns a dictionary of width to WebP bytes."""
+        from PIL import Image, ImageOps
+        with Image.open(io.BytesIO(data)) as original:
+            image = ImageOps.exif_transpose(original).convert("RGB")
+        thumbnails = {}
+        for width in widths:
+            # Never upscale images smaller than the thumbnail width
+            size_width = min(width, image.width)
+            size_height = max(1, round(image.height * size_width / image.width))
+            buffer = io.BytesIO()
+            image.resize((size_width, size_height), Image.LANCZOS).save(buffer, "WEBP", quality=quality)
+            thumbnails[width] = buffer.getvalue()
+        return thumbnails
+
+    def thumbnail_name(image_name, width):
+        """ Get the storage path of an image's thumbnail at the given width.
+
+        Args:
+            image_name: Path of the original image within the bucket
+            width: Width (px) of the thumbnail"""
+        stem, _ = os.path.splitext(image_name)
+        return f"thumbs/{width}/{stem}.webp"
+
+    def upload_image(supabase, data, image_name, content_type, widths=THUMBNAIL_WIDTHS):
+        """ Upload an image and its thumbnails to Supabase storage.
+
+        Args:
+            supabase: Supabase client instance
+            data: Bytes of the image
+            image_name: Path to store the original image at within the bucket
+            content_type: MIME type of the original image
+            widths: Widths (px) to create thumbnails at
+
+        Returns a dictionary of width (as a string) to thumbnail path, to be saved on the entry.
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        bucket = supabase.storage.from_(BUCKET)
+        # Thumbnails first, so a stored original always has its thumbnails
+        thumbs = {}
+        for width, thumbnail in ImageFunctions.make_thumbnails(data, widths).items():
+            thumb_name = ImageFunctions.thumbnail_name(image_name, width)
+            bucket.upload(thumb_name, thumbnail, file_options={"content-type": "image/webp", "upsert": "true"})
+            thumbs[str(width)] = thumb_name
+        bucket.upload(image_name, data, file_options={"content-type": content_type, "upsert": "true"})
+        return thumbs
+
+    def image_exists(supabase, image_name):
+        """ Check whether an image is already stored in the bucket.
+
+        Args:
+            supabase: Supabase client instance
+            image_name: Path of the image within the bucket
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        return _object_exists(supabase.storage.from_(BUCKET), image_name)
+
+    def image_hash(data):
+        """ Get the SHA-256 hash of an image's bytes, which identifies it whatever its file name.
+
+        Args:
+            data: Bytes of the image"""
+        return hashlib.sha256(data).hexdigest()
+
+    def store_image(supabase, data, file_name, content_type, widths=THUMBNAIL_WIDTHS):
+        """ Store an image under a name made from its content hash, only uploading it if not already stored.
+
+        An image already saved on an entry is found by its hash in the database without
+        touching storage, so saving the same photo again costs no upload or extra storage.
+
+        Args:
+            supabase: Supabase client instance
+            data: Bytes of the image
+            file_name: Original file name of the image, for its extension
+            content_type: MIME type of the image
+            widths: Widths (px) to create thumbnails at
+
+        Returns the image path, dictionary of width (as a string) to thumbnail path, and image hash,
+        to be saved on the entry.
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        image_hash = ImageFunctions.image_hash(data)
+        existing = jf.find_image(supabase, image_hash)
+        if existing and existing["imagepath"]:
+            return existing["imagepath"], existing["imagethumbs"], image_hash
+
+        _, ext = os.path.splitext(file_name)
+        image_name = f"{image_hash}{ext.lower()}"
+        if ImageFunctions.image_exists(supabase, image_name):
+            # Stored before but not on any entry, e.g. the entry failed to save
+            thumbs = {str(width): ImageFunctions.thumbnail_name(image_name, width) for width in widths}
+        else:
+            thumbs = ImageFunctions.upload_image(supabase, data, image_name, content_type, widths)
+        return image_name, thumbs, image_hash
+
+    def display_path(entry, width):
+        """ Get the best image path to display an entry's image at the given width.
+
+        Uses the smallest stored thumbnail at least as wide as requested, falling back
+        to the original image for entries saved before thumbnails were created.
+
+        Args:
+            entry: Journal entry dictionary
+            width: Width (px) the image will be displayed at"""
+        thumbs = entry.get("imagethumbs") or {}
+        for thumb_width in sorted(int(w) for w in thumbs):
+            if thumb_width >= width:
+                return thumbs[str(thumb_width)]
+        return entry.get("imagepath")
+
+
+class ImageUrlCache:
+    """ Sign image paths in bulk and reuse the signed URLs until shortly before they expire.
+
+    Args:
+        supabase: Supabase client instance
+        bucket: Name of the storage bucket holding the images
+        expires_in: Seconds each signed URL is valid for
+        margin: Seconds before expiry at which a URL is signed again"""
+    def __init__(self, supabase, bucket=BUCKET, expires_in=3600, margin=300):
+        self.supabase = supabase
+        self.bucket = bucket
+        self.expires_in = expires_in
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._urls = {}
+
+    def get_url(self, path):
+        """ Get a signed URL for a single image path, or None if it could not be signed.
+
+        Args:
+            path: Path of the image within the bucket"""
+        return self.get_urls([path]).get(path)
+
+    def get_urls(self, paths):
+        """ Get signed URLs for many image paths, signing any not already cached in one request.
+
+        Args:
+            paths: Paths of the images within the bucket"""
+        now = time.monotonic()
+        paths = list(dict.fromkeys(p for p in paths if p))
+        with self._lock:
+            missing = [p for p in paths if p not in self._urls or self._urls[p][1] <= now]
+
+        if missing:
+            signed = self.supabase.storage.from_(self.bucket).create_signed_urls(missing, self.expires_in)
+            valid_until = now + self.expires_in - self.margin
+            with self._lock:
+                for item in signed:
+                    url = item.get("signedURL") or item.get("signedUrl")
+                    if url and not item.get("error"):
+                        self._urls[item["path"]] = (url, valid_until)
+
+        with self._lock:
+            return {p: self._urls[p][0] for p in paths if p in self._urls}
+
+    def clear(self):
+        """ Forget every cached URL."""
+        with self._lock:
+            self._urls.clear()
+
+
+def _object_exists(bucket, path):
+    """ Check whether a file is stored in a bucket, listing its folder on clients without exists()."""
+    if hasattr(bucket, "exists"):
+        return bucket.exists(path)
+    folder, _, name = path.rpartition("/")
+    return any(item.get("name") == name for item in bucket.list(folder, {"search": name}))
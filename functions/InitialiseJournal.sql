@@ -1,6 +1,9 @@
 --Run this script to initialise the journal database schema in Supabase
 --https://supabase.com/
 
+--pgvector, for storing entry embeddings
+create extension if not exists vector;
+
 --Table to hold saved entries
 create table entry (
   entryid bigserial primary key,
@@ -12,17 +15,219 @@ create table entry (
   weather text,
   temperature decimal,
   imagepath text,
-  datecreated timestamptz,
+  imagethumbs jsonb,
+  imagehash text,
+  datecreated timestamptz default now(),
   datemodified timestamptz,
-  datedeleted timestamptz
+  datedeleted timestamptz,
+  entrysearch tsvector generated always as (to_tsvector('english', coalesce(entrytext, ''))) stored,
+  embedding vector(384)
 );
 
 --Table to hold step count data
 create table step (
   stepid bigserial primary key,
-  stepdate date,
+  stepdate date unique,
   steps int,
-  datecreated timestamptz,
+  datecreated timestamptz default now(),
   datemodified timestamptz,
   datedeleted timestamptz
-);
\ No newline at end of file
+);
+
+--Set datemodified from the database's own clock on every write, so the app's cache can sync on it
+--whatever timezone (or clock) the app and the Steps API run with
+create function set_datemodified() returns trigger
+language plpgsql as $$
+begin
+  new.datemodified := now();
+  return new;
+end;
+$$;
+
+create trigger entry_set_datemodified before insert or update on entry
+for each row execute function set_datemodified();
+
+create trigger step_set_datemodified before insert or update on step
+for each row execute function set_datemodified();
+
+--Indexes for looking up entries and steps by date, and for syncing recent changes
+--(step.stepdate is already indexed by its unique constraint)
+create index entry_entrydate_idx on entry (entrydate desc);
+create index entry_datedeleted_idx on entry (datedeleted);
+create index entry_datecreated_idx on entry (datecreated);
+create index entry_datemodified_idx on entry (datemodified);
+create index entry_imagehash_idx on entry (imagehash);
+create index entry_entrysearch_idx on entry using gin (entrysearch);
+create index entry_embedding_idx on entry using hnsw (embedding vector_cosine_ops);
+create index step_datecreated_idx on step (datecreated);
+create index step_datemodified_idx on step (datemodified);
+
+--View joining each live entry with the steps recorded for its date
+create view entry_with_steps with (security_invoker = on) as
+select
+  e.entryid, e.entrydate, e.entrytext, e.topic, e.sentiment, e.mood, e.weather, e.temperature,
+  e.imagepath, e.imagethumbs, e.imagehash, e.datecreated, e.datemodified, e.datedeleted,
+  s.steps
+from entry e
+left join lateral (
+  select steps from step
+  where step.stepdate = e.entrydate
+  order by step.stepid desc
+  limit 1
+) s on true
+where e.datedeleted is null;
+
+
+--To upgrade an existing database to one step row per day, remove duplicates then add the constraint
+--delete from step a using step b where a.stepdate = b.stepdate and a.stepid < b.stepid;
+--alter table step add constraint step_stepdate_key unique (stepdate);
+
+--To upgrade an existing database to content-addressed images, add the hash column and its index
+--(then drop and re-create entry_with_steps above, so it includes imagehash)
+--alter table entry add column imagehash text;
+--create index entry_imagehash_idx on entry (imagehash);
+
+--To upgrade an existing database to timestamps set by the database, create set_datemodified and its
+--two triggers above (timestamps written before this were the app's local time without an offset)
+
+--To rename moods scored automatically under VADER's names to the app's own moods
+--update entry set mood = 'Okay' where mood = 'Neutral';
+--update entry set mood = 'Depressed' where mood = 'Upset';
+
+--Daily, weekly and monthly averages and counts for the Statistics dashboard
+create materialized view entry_rollup as
+with periods as (
+  select g.granularity, date_trunc(g.granularity, e.entrydate)::date as period, e.*
+  from entry_with_steps e
+  cross join (values ('day'), ('week'), ('month')) as g(granularity)
+),
+topics as (
+  select granularity, period, jsonb_object_agg(topic, n) as topiccounts
+  from (select granularity, period, topic, count(*) as n from periods where topic is not null group by 1, 2, 3) t
+  group by 1, 2
+),
+moods as (
+  select granularity, period, jsonb_object_agg(mood, n) as moodcounts
+  from (select granularity, period, mood, count(*) as n from periods where mood is not null group by 1, 2, 3) m
+  group by 1, 2
+)
+select
+  p.granularity,
+  p.period,
+  avg(p.sentiment) as sentiment,
+  avg(p.temperature) as temperature,
+  avg(p.steps) as steps,
+  count(*) as entries,
+  coalesce(t.topiccounts, '{}'::jsonb) as topiccounts,
+  coalesce(m.moodcounts, '{}'::jsonb) as moodcounts
+from periods p
+left join topics t using (granularity, period)
+left join moods m using (granularity, period)
+group by p.granularity, p.period, t.topiccounts, m.moodcounts;
+
+create unique index entry_rollup_idx on entry_rollup (granularity, period);
+
+--Writes to entries and steps only count themselves, rather than refreshing the rollups every statement
+create sequence entry_rollup_changes;
+
+--The last counted write included in the rollups (a single row)
+create table entry_rollup_state (
+  id boolean primary key default true check (id),
+  refreshedchange bigint not null default 0,
+  daterefreshed timestamptz
+);
+
+insert into entry_rollup_state default values;
+
+create function count_entry_rollup_change() returns trigger
+language plpgsql security definer as $$
+begin
+  --Held until the write commits, so a refresh can wait for counted writes to be visible
+  perform pg_advisory_xact_lock_shared(hashtext('entry_rollup'));
+  perform nextval('entry_rollup_changes');
+  return null;
+end;
+$$;
+
+create trigger entry_rollup_change after insert or update or delete on entry
+for each statement execute function count_entry_rollup_change();
+
+create trigger step_rollup_change after insert or update or delete on step
+for each statement execute function count_entry_rollup_change();
+
+--Refresh the rollups if anything has been written since the last refresh, returning whether it did.
+--Called before the Statistics page reads them, so a batch of writes costs one refresh, and concurrently,
+--so reads carry on from the old rollups meanwhile (entry_rollup_idx is what allows this).
+--It can also be scheduled with pg_cron:
+--select cron.schedule('refresh-entry-rollup', '*/5 * * * *', 'select refresh_entry_rollup()');
+create function refresh_entry_rollup() returns boolean
+language plpgsql security definer as $$
+declare
+  latest bigint;
+begin
+  --Wait for writes already counted to commit, then let new ones carry on
+  perform pg_advisory_lock(hashtext('entry_rollup'));
+  select case when is_called then last_value else 0 end into latest from entry_rollup_changes;
+  perform pg_advisory_unlock(hashtext('entry_rollup'));
+  if latest <= (select refreshedchange from entry_rollup_state) then
+    return false;
+  end if;
+  --One refresh at a time, anyone else reads the rollups as they are
+  if not pg_try_advisory_xact_lock(hashtext('entry_rollup_refresh')) then
+    return false;
+  end if;
+  refresh materialized view concurrently entry_rollup;
+  update entry_rollup_state set refreshedchange = greatest(refreshedchange, latest), daterefreshed = now();
+  return true;
+end;
+$$;
+
+--To upgrade an existing database from refreshing the rollups on every write, drop the old triggers
+--then create entry_rollup_changes, entry_rollup_state, count_entry_rollup_change, its two triggers
+--and refresh_entry_rollup above
+--drop trigger entry_rollup_refresh on entry;
+--drop trigger step_rollup_refresh on step;
+--drop function refresh_entry_rollup();
+
+--Ranked full-text search over live entries
+create function search_entries(query text, lim int default 20, off int default 0)
+returns table (
+  entryid bigint,
+  entrydate date,
+  entrytext text,
+  topic text,
+  mood text,
+  imagepath text,
+  rank real,
+  headline text
+)
+language sql stable as $$
+  select e.entryid, e.entrydate, e.entrytext, e.topic, e.mood, e.imagepath,
+    ts_rank(e.entrysearch, q) as rank,
+    ts_headline('english', e.entrytext, q, 'StartSel=**, StopSel=**, MaxFragments=2') as headline
+  from entry e, websearch_to_tsquery('english', query) q
+  where e.entrysearch @@ q and e.datedeleted is null
+  order by rank desc, e.entrydate desc
+  limit lim offset off;
+$$;
+
+--Live entries closest in meaning to an embedding
+create function match_entries(query_embedding vector(384), match_count int default 5, exclude_id bigint default null)
+returns table (
+  entryid bigint,
+  entrydate date,
+  entrytext text,
+  topic text,
+  mood text,
+  similarity float
+)
+language sql stable as $$
+  select e.entryid, e.entrydate, e.entrytext, e.topic, e.mood,
+    1 - (e.embedding <=> query_embedding) as similarity
+  from entry e
+  where e.embedding is not null
+    and e.datedeleted is null
+    and (exclude_id is null or e.entryid <> exclude_id)
+  order by e.embedding <=> query_embedding
+  limit match_count;
+$$;
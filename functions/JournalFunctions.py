@@ -4,42 +4,65 @@
 # https://supabase.com/
 
 # Imports
-from datetime import datetime
+from datetime import date, datetime, timezone
+
+# Entry columns returned to the app (leaves out the entrysearch index column)
+ENTRY_COLUMNS = "entryid, entrydate, entrytext, topic, sentiment, mood, weather, temperature, imagepath, imagethumbs, imagehash, datecreated, datemodified, datedeleted"
+
+
+def utc_now():
+    """ Get the current time in UTC with its offset, e.g. 2024-05-01 09:30:00+00:00.
+
+    Written to the timestamp columns, so rows written by the app, the Steps API and the
+    database compare correctly whichever timezone each runs in (on Supabase, datemodified
+    is also set by the database itself, see InitialiseJournal.sql)."""
+    return datetime.now(timezone.utc).isoformat(sep=" ", timespec="seconds")
+
 
 class JournalFunctions:
     @staticmethod
     # Get list of journal entries
-    def get_entries(supabase):
-        """ Get list of journal entries with associated steps for that day.
+    def get_entries(supabase, limit=None, before_date=None, columns="*"):
+        """ Get list of journal entries with associated steps for that day, newest first.
+
+        The entry and step tables are joined server-side by the entry_with_steps view,
+        so a page of entries costs one query however long the journal is.
 
         Args:
             supabase: Supabase client instance
+            limit: Optional maximum number of entries to return
+            before_date: Optional date (YYYY-MM-DD), only entries before it are returned
+            columns: Comma separated columns to select, defaults to all columns
 
             To create a supabase client instance
             supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
-        # Fetch all entries
-        entries = (
-            supabase.table("entry")
-            .select("*")
-            .is_("datedeleted", None)
+        query = (
+            supabase.table("entry_with_steps")
+            .select(columns)
             .order("entrydate", desc=True)
-            .execute()
-            .data
         )
+        if before_date is not None:
+            query = query.lt("entrydate", before_date)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.execute().data
 
-        # Fetch all steps
-        steps = supabase.table("step").select("stepdate, steps").execute().data
-        steps_map = {s["stepdate"]: s["steps"] for s in steps}
+    def get_entry(supabase, eid, columns="*"):
+        """ Get a single journal entry by its entryid, or None if there is no such entry.
 
-        # Join manually
-        for e in entries:
-            e["steps"] = steps_map.get(e["entrydate"])
+        Args:
+            supabase: Supabase client instance
+            eid: Entry ID of the journal entry
+            columns: Comma separated columns to select, defaults to all columns
 
-        return entries
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        response = supabase.table("entry").select(columns).eq("entryid", eid).limit(1).execute()
+        return response.data[0] if response.data else None
     
     # Add a new journal entry
-    def add_entry(supabase, entry_date, text, sentiment, mood, weather, temperature, topic, image_path=None ):
-        """ Add a new journal entry to the database.
+    def add_entry(supabase, entry_date, text, sentiment, mood, weather, temperature, topic, image_path=None, image_thumbs=None, image_hash=None):
+        """ Add a new journal entry to the database and return its entryid.
 
         Args:
             supabase: Supabase client instance
@@ -50,12 +73,15 @@ class JournalFunctions:
             weather: Weather description
             temperature: Temperature value
             image_path: Optional path to an associated image
+            image_thumbs: Optional dictionary of width to thumbnail path for the image
+            image_hash: Optional content hash of the image, see ImageFunctions.store_image
             topic: Identified topic for the entry
 
             To create a supabase client instance
             supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
             """
-        supabase.table("entry").insert({
+        now = utc_now()
+        response = supabase.table("entry").insert({
             "entrydate": entry_date,
             "entrytext": text,
             "sentiment": sentiment,
@@ -63,12 +89,15 @@ class JournalFunctions:
             "weather": weather,
             "temperature": temperature,
             "imagepath": image_path,
-            "topic": topic
+            "imagethumbs": image_thumbs,
+            "imagehash": image_hash,
+            "topic": topic,
+            "datecreated": now
         }).execute()
-        return True
+        return response.data[0]["entryid"]
     
 
-    def update_entry(supabase, eid, text, sentiment, mood, weather, temperature, topic, image_path=None):
+    def update_entry(supabase, eid, text, sentiment, mood, weather, temperature, topic, image_path=None, image_thumbs=None, image_hash=None):
         """ Update an existing journal entry in the database.
 
         Args:
@@ -79,25 +108,156 @@ class JournalFunctions:
             mood: Updated mood rating (detected mood)
             weather: Updated weather description
             temperature: Updated temperature value
-            image_path: Optional updated path to an associated image
+            image_path: Optional updated path to an associated image, the current image is kept if None
+            image_thumbs: Optional dictionary of width to thumbnail path for the image
+            image_hash: Optional content hash of the image, see ImageFunctions.store_image
             topic: Identified topic for the entry
 
             To create a supabase client instance
             supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
             """
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        supabase.table("entry").update({
+        now = utc_now()
+        fields = {
             "entrytext": text,
             "sentiment": sentiment,
             "mood": mood,
             "weather": weather,
             "temperature": temperature,
-            "imagepath": image_path,
             "topic": topic,
             "datemodified": now
-        }).eq("entryid", eid).execute()
+        }
+        if image_path is not None:
+            fields["imagepath"] = image_path
+            fields["imagethumbs"] = image_thumbs
+            fields["imagehash"] = image_hash
+        supabase.table("entry").update(fields).eq("entryid", eid).execute()
         return True
 
+    def enrich_entry(supabase, eid, weather, temperature, topic, sentiment=None, mood=None, modified=None):
+        """ Fill in the derived weather, topic and sentiment fields of an existing entry.
+
+        Returns whether the entry was updated, which it is not if it has been modified since
+        the modified entry (see below) was read.
+
+        Args:
+            supabase: Supabase client instance
+            eid: Entry ID of the journal entry to enrich
+            weather: Weather description
+            temperature: Temperature value
+            topic: Identified topic for the entry
+            sentiment: Optional sentiment analysis result, left unchanged if None
+            mood: Optional detected mood, left unchanged if None
+            modified: Optional entry as read before enriching it, the entry is only updated if its
+                datemodified has not changed since
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            """
+        now = utc_now()
+        fields = {
+            "weather": weather,
+            "temperature": temperature,
+            "topic": topic,
+            "datemodified": now
+        }
+        if sentiment is not None:
+            fields["sentiment"] = sentiment
+            fields["mood"] = mood
+        query = supabase.table("entry").update(fields).eq("entryid", eid)
+        if modified is not None:
+            if modified.get("datemodified") is None:
+                query = query.is_("datemodified", None)
+            else:
+                query = query.eq("datemodified", modified["datemodified"])
+        return bool(query.execute().data)
+
+    def update_entries(supabase, rows, chunk_size=500):
+        """ Update fields of many existing entries in batched upserts keyed on entryid.
+
+        Only the columns given in the rows are changed, so each row needs its entryid
+        and the fields to set, e.g. {"entryid": 1, "topic": "work"}.
+
+        Args:
+            supabase: Supabase client instance
+            rows: List of dictionaries of entryid and the fields to update
+            chunk_size: Maximum number of rows sent per request
+
+        Returns the number of entries updated.
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        now = utc_now()
+        rows = [dict(row, datemodified=now) for row in rows]
+        for i in range(0, len(rows), chunk_size):
+            supabase.table("entry").upsert(rows[i:i + chunk_size], on_conflict="entryid").execute()
+        return len(rows)
+
+    def find_image(supabase, image_hash):
+        """ Get the stored path and thumbnails of an image already saved on an entry, or None.
+
+        Args:
+            supabase: Supabase client instance
+            image_hash: Content hash of the image, see ImageFunctions.image_hash
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        response = (
+            supabase.table("entry")
+            .select("imagepath, imagethumbs")
+            .eq("imagehash", image_hash)
+            .limit(1)
+            .execute()
+        )
+        return response.data[0] if response.data else None
+
+    def get_entry_page(supabase, after_id=None, limit=500, columns="entryid, entrytext"):
+        """ Get a page of live journal entries in entryid order, for working through every entry.
+
+        Pages are found by entryid rather than offset, so each page costs the same however far in.
+
+        Args:
+            supabase: Supabase client instance
+            after_id: Optional entry ID, only entries after it are returned
+            limit: Maximum number of entries to return
+            columns: Comma separated columns to select
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        query = (
+            supabase.table("entry")
+            .select(columns)
+            .is_("datedeleted", None)
+            .order("entryid")
+            .limit(limit)
+        )
+        if after_id is not None:
+            query = query.gt("entryid", after_id)
+        return query.execute().data
+
+    def get_unenriched_entries(supabase, after_id=None, limit=500):
+        """ Get a page of live journal entries still missing their topic, or today's weather, in entryid order.
+
+        Earlier days missing their weather are left out, as it can no longer be looked up.
+
+        Args:
+            supabase: Supabase client instance
+            after_id: Optional entry ID, only entries after it are returned
+            limit: Maximum number of entries to return
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        query = (
+            supabase.table("entry")
+            .select("entryid, entrydate, entrytext, sentiment, topic, weather")
+            .is_("datedeleted", None)
+            .or_(f"topic.is.null,entrydate.eq.{date.today().isoformat()}")
+            .order("entryid")
+            .limit(limit)
+        )
+        if after_id is not None:
+            query = query.gt("entryid", after_id)
+        return query.execute().data
+
     def delete_entry(supabase, eid):
         """ Soft delete a journal entry by setting datedeleted.
 
@@ -107,7 +267,7 @@ class JournalFunctions:
             
             To create a supabase client instance
             supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now = utc_now()
         supabase.table("entry").update({
             "datemodified": now,
             "datedeleted": now
@@ -130,7 +290,7 @@ class JournalFunctions:
             return False
         
     def add_steps(supabase, step_date, steps):
-        """ Add step count data for a specific date.
+        """ Add step count data for a specific date, replacing any count already recorded for it.
 
         Args:
             supabase: Supabase client instance
@@ -139,10 +299,39 @@ class JournalFunctions:
 
             To create a supabase client instance
             supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
-        supabase.table("step").insert({
-            "stepdate": step_date,
-            "steps": steps
-        }).execute()
+        JournalFunctions.upsert_steps(supabase, [(step_date, steps)])
+
+    def upsert_steps(supabase, records, chunk_size=1000):
+        """ Add or replace step count data for many dates in batched upserts keyed on stepdate.
+
+        Retried or repeated records for a date overwrite the earlier count rather than
+        adding a duplicate row. If a date appears more than once the last count wins.
+
+        Args:
+            supabase: Supabase client instance
+            records: List of (step_date, steps) pairs, dates as YYYY-MM-DD
+            chunk_size: Maximum number of rows sent per request
+
+        Returns the number of dates written.
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        rows = JournalFunctions.step_rows(records)
+        for i in range(0, len(rows), chunk_size):
+            supabase.table("step").upsert(rows[i:i + chunk_size], on_conflict="stepdate").execute()
+        return len(rows)
+
+    def step_rows(records):
+        """ Build step table rows for an upsert, keeping the last count given for each date.
+
+        Args:
+            records: List of (step_date, steps) pairs, dates as YYYY-MM-DD"""
+        now = utc_now()
+        latest = {str(step_date): steps for step_date, steps in records}
+        return [
+            {"stepdate": step_date, "steps": steps, "datemodified": now}
+            for step_date, steps in latest.items()
+        ]
 
     def get_steps(supabase, date):
         """ Get step count for a specific date.
@@ -167,6 +356,115 @@ class JournalFunctions:
         response = supabase.table("step").select("stepdate, steps").execute()
         return response.data
     
+    def search_entries(supabase, query, limit=20, offset=0):
+        """ Search entry text, returning the best matching entries first.
+
+        Uses the search_entries database function over the GIN-indexed entrysearch column.
+        The query supports web search syntax, e.g. "walk -rain" or "\"sunny day\"".
+
+        Args:
+            supabase: Supabase client instance
+            query: Text to search for
+            limit: Maximum number of results to return
+            offset: Number of results to skip, for paging
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        if not query or not query.strip():
+            return []
+        response = supabase.rpc("search_entries", {"query": query, "lim": limit, "off": offset}).execute()
+        return response.data
+
+    def set_embedding(supabase, eid, embedding):
+        """ Store the text embedding of an entry in its pgvector column.
+
+        Args:
+            supabase: Supabase client instance
+            eid: Entry ID of the journal entry
+            embedding: List of floats from the topic model
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        supabase.table("entry").update({"embedding": embedding}).eq("entryid", eid).execute()
+        return True
+
+    def get_embedding(supabase, eid):
+        """ Get the stored text embedding of an entry, or None if it has none.
+
+        Args:
+            supabase: Supabase client instance
+            eid: Entry ID of the journal entry
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        response = supabase.table("entry").select("embedding").eq("entryid", eid).execute()
+        if not response.data or response.data[0]["embedding"] is None:
+            return None
+        embedding = response.data[0]["embedding"]
+        # pgvector values come back as a string such as "[0.1,0.2]"
+        if isinstance(embedding, str):
+            embedding = [float(x) for x in embedding.strip("[]").split(",")]
+        return embedding
+
+    def match_entries(supabase, embedding, count=5, exclude_id=None):
+        """ Get the live entries whose embeddings are closest to the given embedding.
+
+        Args:
+            supabase: Supabase client instance
+            embedding: List of floats to compare against
+            count: Number of entries to return
+            exclude_id: Optional entry ID to leave out
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        response = supabase.rpc("match_entries", {
+            "query_embedding": embedding,
+            "match_count": count,
+            "exclude_id": exclude_id
+        }).execute()
+        return response.data
+
+    def get_rollups(supabase, granularity="day", start=None, end=None, page_size=1000):
+        """ Get average sentiment, temperature and steps, and entry counts by topic and mood, per period.
+
+        Reads from the entry_rollup materialized view, refreshing it first if entries or steps
+        have been written since it was last refreshed, so the cost depends on the number of
+        periods rather than the number of entries.
+
+        Args:
+            supabase: Supabase client instance
+            granularity: Period to aggregate by, one of "day", "week" or "month"
+            start: Optional first date to include (YYYY-MM-DD)
+            end: Optional last date to include (YYYY-MM-DD)
+            page_size: Rows fetched per request
+
+            To create a supabase client instance
+            supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)"""
+        if granularity not in ("day", "week", "month"):
+            raise ValueError(f"Unknown granularity: {granularity}")
+        supabase.rpc("refresh_entry_rollup", {}).execute()
+        # Paged on period until an empty page, as the API caps how many rows one request returns
+        rows, last = [], None
+        while True:
+            query = (
+                supabase.table("entry_rollup")
+                .select("*")
+                .eq("granularity", granularity)
+                .order("period")
+                .limit(page_size)
+            )
+            if start is not None:
+                query = query.gte("period", start)
+            if end is not None:
+                query = query.lte("period", end)
+            if last is not None:
+                query = query.gt("period", last)
+            page = query.execute().data
+            if not page:
+                return rows
+            rows.extend(page)
+            last = page[-1]["period"]
+
     def upload_image(supabase, file_path, file_name):
         """ Upload an image to Supabase storage.
 
@@ -0,0 +1,542 @@
+#!/usr/bin/python3
+# Local, offline stand-in for the Supabase client.
+# LocalClient provides the parts of the supabase-py Client used by the journal
+# functions (table queries, rpc and storage buckets), backed by a SQLite
+# database built from InitialiseJournal.sql and a local image directory.
+# Pass it anywhere a Supabase client is expected, e.g.
+#   supabase = LocalClient("journal.sqlite", "journal-images")
+#   JournalFunctions.get_entries(supabase)
+
+# Imports
+import re
+import json
+import sqlite3
+import threading
+from datetime import date, datetime
+from pathlib import Path
+
+# Schema script shared with Supabase
+SCHEMA_PATH = Path(__file__).parent / "InitialiseJournal.sql"
+
+# Columns holding JSON (jsonb or vector in Postgres), stored as text locally
+JSON_COLUMNS = {"imagethumbs", "topiccounts", "moodcounts", "embedding"}
+
+# Postgres column types and their SQLite equivalents
+TYPE_MAP = {
+    "bigserial": "integer",
+    "bigint": "integer",
+    "int": "integer",
+    "boolean": "integer",
+    "decimal": "real",
+    "date": "text",
+    "text": "text",
+    "timestamptz": "text",
+    "jsonb": "text",
+    "vector": "text"
+}
+
+# Local versions of the views, search index and functions in InitialiseJournal.sql
+LOCAL_SCHEMA = """
+create view if not exists entry_with_steps as
+select
+  e.entryid, e.entrydate, e.entrytext, e.topic, e.sentiment, e.mood, e.weather, e.temperature,
+  e.imagepath, e.imagethumbs, e.imagehash, e.datecreated, e.datemodified, e.datedeleted,
+  (select steps from step where step.stepdate = e.entrydate order by step.stepid desc limit 1) as steps
+from entry e
+where e.datedeleted is null;
+
+-- Re-created on every start, so a database made by an earlier version picks up changes to it
+drop view if exists entry_rollup;
+create view entry_rollup as
+with periods as (
+  select g.granularity,
+    case g.granularity
+      when 'day' then e.entrydate
+      when 'week' then date(e.entrydate, '-6 days', 'weekday 1')
+      else strftime('%Y-%m-01', e.entrydate)
+    end as period,
+    e.*
+  from entry_with_steps e
+  cross join (select 'day' as granularity union all select 'week' union all select 'month') g
+),
+topics as (
+  select granularity, period, json_group_object(topic, n) as topiccounts from (
+    select granularity, period, topic, count(*) as n from periods
+    where topic is not null group by granularity, period, topic
+  ) group by granularity, period
+),
+moods as (
+  select granularity, period, json_group_object(mood, n) as moodcounts from (
+    select granularity, period, mood, count(*) as n from periods
+    where mood is not null group by granularity, period, mood
+  ) group by granularity, period
+)
+-- Counts are grouped once and joined, rather than counted again for every period
+select
+  p.granularity,
+  p.period,
+  avg(p.sentiment) as sentiment,
+  avg(p.temperature) as temperature,
+  avg(p.steps) as steps,
+  count(*) as entries,
+  coalesce(t.topiccounts, '{}') as topiccounts,
+  coalesce(m.moodcounts, '{}') as moodcounts
+from periods p
+left join topics t on t.granularity = p.granularity and t.period = p.period
+left join moods m on m.granularity = p.granularity and m.period = p.period
+group by p.granularity, p.period;
+
+create virtual table if not exists entry_fts using fts5(
+  entrytext, content='entry', content_rowid='entryid', tokenize='porter'
+);
+
+create trigger if not exists entry_fts_insert after insert on entry begin
+  insert into entry_fts (rowid, entrytext) values (new.entryid, new.entrytext);
+end;
+
+create trigger if not exists entry_fts_delete after delete on entry begin
+  insert into entry_fts (entry_fts, rowid, entrytext) values ('delete', old.entryid, old.entrytext);
+end;
+
+create trigger if not exists entry_fts_update after update of entrytext on entry begin
+  insert into entry_fts (entry_fts, rowid, entrytext) values ('delete', old.entryid, old.entrytext);
+  insert into entry_fts (rowid, entrytext) values (new.entryid, new.entrytext);
+end;
+"""
+
+
+class LocalStorageError(Exception):
+    """ Raised when a local storage or database request fails."""
+
+
+class LocalResponse:
+    """ Result of a local request, matching the .data attribute of a Supabase response."""
+    def __init__(self, data):
+        self.data = data
+
+
+class LocalClient:
+    """ SQLite and local directory replacement for a Supabase client.
+
+    Args:
+        db_path: Path to the SQLite database file, created if missing (":memory:" for a throwaway database)
+        image_dir: Directory to store uploaded images in, one sub-directory per bucket
+        schema_path: Path to the schema script to build the tables and indexes from
+        asynchronous: Whether execute() returns an awaitable, to stand in for the async Supabase client"""
+    def __init__(self, db_path, image_dir="local-images", schema_path=SCHEMA_PATH, asynchronous=False):
+        self.db_path = str(db_path)
+        self.image_dir = Path(image_dir)
+        self.asynchronous = asynchronous
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("pragma journal_mode = wal")
+        self._conn.execute("pragma synchronous = normal")
+        with self._lock, self._conn:
+            self._conn.executescript(sqlite_schema(Path(schema_path).read_text()) + LOCAL_SCHEMA)
+        self.storage = LocalStorage(self.image_dir)
+
+    @property
+    def postgrest(self):
+        # The async Supabase client is closed through client.postgrest.aclose()
+        return self
+
+    def table(self, name):
+        """ Start a query on a table or view.
+
+        Args:
+            name: Name of the table or view"""
+        return LocalQuery(self, name)
+
+    def rpc(self, name, params=None):
+        """ Call one of the database functions from InitialiseJournal.sql.
+
+        Args:
+            name: Name of the function
+            params: Dictionary of function arguments"""
+        functions = {
+            "search_entries": self._search_entries,
+            "match_entries": self._match_entries,
+            "refresh_entry_rollup": self._refresh_entry_rollup
+        }
+        if name not in functions:
+            raise LocalStorageError(f"Unknown function: {name}")
+        return LocalCall(self, functions[name], params or {})
+
+    def close(self):
+        """ Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    async def aclose(self):
+        """ Close the database connection, for use in place of the async client."""
+        self.close()
+
+    def execute_sql(self, sql, params=()):
+        """ Run a SQL statement and return the resulting rows as dictionaries.
+
+        Args:
+            sql: SQL statement
+            params: Parameters for the statement's ? placeholders"""
+        return self.execute_sql_batch([(sql, params)])
+
+    def execute_sql_batch(self, statements):
+        """ Run several SQL statements in one transaction and return all resulting rows as dictionaries.
+
+        Args:
+            statements: List of (sql, params) pairs"""
+        rows = []
+        with self._lock:
+            try:
+                with self._conn:
+                    for sql, params in statements:
+                        rows.extend(self._conn.execute(sql, [_to_sqlite(p) for p in params]).fetchall())
+            except sqlite3.Error as e:
+                raise LocalStorageError(str(e)) from e
+        return [_from_sqlite(row) for row in rows]
+
+    def _search_entries(self, query, lim=20, off=0):
+        match = fts_query(query)
+        if not match:
+            return []
+        return self.execute_sql(
+            """select e.entryid, e.entrydate, e.entrytext, e.topic, e.mood, e.imagepath,
+                 -bm25(entry_fts) as rank,
+                 snippet(entry_fts, 0, '**', '**', '…', 24) as headline
+               from entry_fts join entry e on e.entryid = entry_fts.rowid
+               where entry_fts match ? and e.datedeleted is null
+               order by rank desc, e.entrydate desc
+               limit ? offset ?""",
+            (match, lim, off)
+        )
+
+    def _refresh_entry_rollup(self):
+        # entry_rollup is a plain view here, so it is always up to date
+        return False
+
+    def _match_entries(self, query_embedding, match_count=5, exclude_id=None):
+        import numpy as np
+        rows = self.execute_sql(
+            """select entryid, entrydate, entrytext, topic, mood, embedding from entry
+               where embedding is not null and datedeleted is null and (? is null or entryid <> ?)""",
+            (exclude_id, exclude_id)
+        )
+        if not rows:
+            return []
+        matrix = np.array([row.pop("embedding") for row in rows], dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        # Cosine similarity, as with pgvector's <=> operator
+        sims = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+        top = np.argsort(-sims)[:match_count]
+        return [dict(rows[i], similarity=float(sims[i])) for i in top]
+
+
+class LocalQuery:
+    """ Query builder for a local table, matching the Supabase query builder methods used by the journal."""
+    def __init__(self, client, table):
+        self.client = client
+        self.table = _identifier(table)
+        self._action = "select"
+        self._columns = "*"
+        self._values = None
+        self._on_conflict = None
+        self._filters = []
+        self._order = []
+        self._limit = None
+
+    def select(self, columns="*"):
+        self._columns = ", ".join(_identifier(c.strip()) for c in columns.split(",")) if columns.strip() != "*" else "*"
+        return self
+
+    def insert(self, values):
+        self._action, self._values = "insert", values
+        return self
+
+    def upsert(self, values, on_conflict=None):
+        self._action, self._values, self._on_conflict = "upsert", values, on_conflict
+        return self
+
+    def update(self, values):
+        self._action, self._values = "update", values
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def is_(self, column, value):
+        return self._filter(column, "is", value)
+
+    def or_(self, filters):
+        """ Match any of a comma separated list of PostgREST filters, e.g. 'a.gt.1,b.is.null'."""
+        clauses, params = [], []
+        for item in _split_filters(filters):
+            column, op, value = item.split(".", 2)
+            clause, param = _condition(column, op, _unquote(value))
+            clauses.append(clause)
+            params.extend(param)
+        self._filters.append(("(" + " or ".join(clauses) + ")", params))
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append(f"{_identifier(column)} {'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, count):
+        self._limit = int(count)
+        return self
+
+    def execute(self):
+        """ Run the query, returning a response with the matching or written rows as .data."""
+        return _respond(self.client, LocalResponse(self._run()))
+
+    def _filter(self, column, op, value):
+        clause, params = _condition(column, op, value)
+        self._filters.append((clause, params))
+        return self
+
+    def _where(self):
+        if not self._filters:
+            return "", []
+        return " where " + " and ".join(c for c, _ in self._filters), [p for _, ps in self._filters for p in ps]
+
+    def _run(self):
+        where, params = self._where()
+        if self._action == "select":
+            sql = f"select {self._columns} from {self.table}{where}"
+            if self._order:
+                sql += " order by " + ", ".join(self._order)
+            if self._limit is not None:
+                sql += f" limit {self._limit}"
+            return self.client.execute_sql(sql, params)
+
+        if self._action == "update":
+            columns = [_identifier(c) for c in self._values]
+            sql = f"update {self.table} set " + ", ".join(f"{c} = ?" for c in columns) + f"{where} returning *"
+            return self.client.execute_sql(sql, list(self._values.values()) + params)
+
+        # Insert or upsert one or many rows, in a single transaction
+        rows = self._values if isinstance(self._values, list) else [self._values]
+        statements = []
+        for row in rows:
+            columns = [_identifier(c) for c in row]
+            sql = f"insert into {self.table} ({', '.join(columns)}) values ({', '.join('?' for _ in columns)})"
+            if self._action == "upsert" and self._on_conflict:
+                keys = [_identifier(c.strip()) for c in self._on_conflict.split(",")]
+                updates = [c for c in columns if c not in keys] or keys
+                sql += f" on conflict ({', '.join(keys)}) do update set " + ", ".join(f"{c} = excluded.{c}" for c in updates)
+            elif self._action == "upsert":
+                sql = sql.replace("insert into", "insert or replace into", 1)
+            statements.append((sql + " returning *", list(row.values())))
+        return self.client.execute_sql_batch(statements)
+
+
+class LocalCall:
+    """ Pending database function call, run on execute() like a Supabase rpc call."""
+    def __init__(self, client, function, params):
+        self.client = client
+        self.function = function
+        self.params = params
+
+    def execute(self):
+        return _respond(self.client, LocalResponse(self.function(**self.params)))
+
+
+class LocalStorage:
+    """ Local directory replacement for Supabase storage, with one sub-directory per bucket.
+
+    Args:
+        root: Directory holding the buckets"""
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def from_(self, bucket):
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", bucket):
+            raise LocalStorageError(f"Invalid bucket name: {bucket}")
+        return LocalBucket(self.root / bucket)
+
+
+class LocalBucket:
+    """ Local directory replacement for a Supabase storage bucket.
+
+    Signed and public URLs are absolute file paths, which st.image can display directly.
+
+    Args:
+        root: Directory holding the bucket's files"""
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def upload(self, path, file, file_options=None):
+        """ Save a file into the bucket, failing if it already exists unless upsert is set."""
+        target = self._path(path)
+        upsert = str((file_options or {}).get("upsert", "false")).lower() == "true"
+        if target.exists() and not upsert:
+            raise LocalStorageError(f"The resource already exists: {path}")
+        if isinstance(file, (bytes, bytearray)):
+            data = file
+        elif isinstance(file, (str, Path)):
+            data = Path(file).read_bytes()
+        else:
+            data = file.read()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        return LocalResponse({"path": path})
+
+    def exists(self, path):
+        return self._path(path).exists()
+
+    def download(self, path):
+        target = self._path(path)
+        if not target.exists():
+            raise LocalStorageError(f"Object not found: {path}")
+        return target.read_bytes()
+
+    def remove(self, paths):
+        for path in paths:
+            self._path(path).unlink(missing_ok=True)
+        return [{"name": path} for path in paths]
+
+    def get_public_url(self, path):
+        return str(self._path(path))
+
+    def create_signed_url(self, path, expires_in, options=None):
+        if not self.exists(path):
+            raise LocalStorageError(f"Object not found: {path}")
+        url = self.get_public_url(path)
+        return {"signedURL": url, "signedUrl": url}
+
+    def create_signed_urls(self, paths, expires_in, options=None):
+        signed = []
+        for path in paths:
+            url = self.get_public_url(path) if self.exists(path) else None
+            error = None if url else "Either the object does not exist or you do not have access to it"
+            signed.append({"path": path, "signedURL": url, "signedUrl": url, "error": error})
+        return signed
+
+    def _path(self, path):
+        target = (self.root / path).resolve()
+        if self.root.resolve() not in target.parents:
+            raise LocalStorageError(f"Invalid path: {path}")
+        return target
+
+
+def sqlite_schema(script):
+    """ Translate the tables and indexes of the Postgres schema script into SQLite.
+
+    Views, functions, triggers and Postgres-only indexes (GIN, HNSW) are left out;
+    their local equivalents are in LOCAL_SCHEMA.
+
+    Args:
+        script: Text of InitialiseJournal.sql"""
+    script = re.sub(r"--[^\n]*", "", script)
+    statements = []
+    for table, body in re.findall(r"create table (\w+) \((.*?)\n\);", script, re.S):
+        columns = []
+        for line in body.split(",\n"):
+            line = line.strip()
+            if not line or "generated always" in line:
+                continue
+            name, pg_type, *rest = line.split(None, 2)
+            rest = rest[0] if rest else ""
+            sqlite_type = TYPE_MAP[pg_type.split("(")[0]]
+            if pg_type == "bigserial":
+                rest = rest.replace("primary key", "primary key autoincrement")
+            rest = rest.replace("default now()", "default (datetime('now'))")
+            columns.append(f"{name} {sqlite_type} {rest}".strip())
+        statements.append(f"create table if not exists {table} (\n  " + ",\n  ".join(columns) + "\n);")
+    for name, table, using, columns in re.findall(r"create index (\w+) on (\w+) (?:using (\w+) )?\((.*?)\);", script):
+        if using:
+            continue
+        statements.append(f"create index if not exists {name} on {table} ({columns});")
+    return "\n".join(statements) + "\n"
+
+
+def fts_query(query):
+    """ Convert a web search style query ("sunny walk", "\"a phrase\"", "walk -rain", "tea or coffee") to FTS5 syntax.
+
+    Args:
+        query: Text to search for"""
+    terms, excluded = [], []
+    for negate, phrase, word in re.findall(r'(-?)(?:"([^"]+)"|(\S+))', query or ""):
+        text = phrase or word
+        if not phrase and text.lower() == "or":
+            if terms and terms[-1] != "OR":
+                terms.append("OR")
+            continue
+        quoted = '"' + text.replace('"', '""') + '"'
+        (excluded if negate else terms).append(quoted)
+    while terms and terms[-1] == "OR":
+        terms.pop()
+    if not terms:
+        return None
+    return " ".join(terms) + "".join(f" NOT {term}" for term in excluded)
+
+
+def _identifier(name):
+    """ Check a table or column name is a plain identifier before it is put into SQL."""
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+        raise LocalStorageError(f"Invalid identifier: {name}")
+    return name
+
+
+def _condition(column, op, value):
+    """ Build a SQL condition and its parameters from a PostgREST style filter."""
+    column = _identifier(column)
+    if op == "is":
+        if value in (None, "null"):
+            return f"{column} is null", []
+        raise LocalStorageError(f"Unsupported is value: {value}")
+    operators = {"eq": "=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+    if op not in operators:
+        raise LocalStorageError(f"Unsupported filter: {op}")
+    return f"{column} {operators[op]} ?", [value]
+
+
+def _split_filters(filters):
+    """ Split a PostgREST or_ filter list on commas outside double quotes."""
+    return [part for part in re.findall(r'(?:[^,"]|"[^"]*")+', filters)]
+
+
+def _unquote(value):
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def _to_sqlite(value):
+    """ Convert a Python value to one SQLite can store."""
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(list(value) if isinstance(value, tuple) else value)
+    if isinstance(value, (date, datetime)):
+        return str(value)
+    if hasattr(value, "tolist"):
+        return json.dumps(value.tolist())
+    return value
+
+
+def _from_sqlite(row):
+    """ Convert a SQLite row to a dictionary, decoding JSON columns."""
+    data = dict(row)
+    for column in JSON_COLUMNS.intersection(data):
+        if isinstance(data[column], str):
+            data[column] = json.loads(data[column])
+    return data
+
+
+def _respond(client, response):
+    """ Return the response, or an awaitable of it for an asynchronous client."""
+    if not client.asynchronous:
+        return response
+
+    async def result():
+        return response
+    return result()
@@ -2,46 +2,317 @@
 # Set of Python functions for analysing sentiment of text inputs.
 
 # Imports
-from nltk.sentiment import SentimentIntensityAnalyzer
-from sentence_transformers import SentenceTransformer, util
+import os
+import threading
+from pathlib import Path
+import numpy as np
+
+# Topics an entry can be classified into, with the descriptions used to embed them
+TOPICS = {
+    "family": "family, parents, auntie, Blair, Bo, James, Kezia, Serenity, Martha, spouse, partner",
+    "health": "health, wellbeing, exercise, meditation, running, walking, sleep, diet, food, nutrition, gym, tidy",
+    "work": "job, career, projects, Workdry, council, boss, colleagues, team",
+    "nature": "nature, parks, walks, outdoors, trees, greenery, hiking, steps, climbing, mountains",
+    "pets": "cats, pets, animals, Penny, Basil, kitty"
+}
+
+# Moods an entry can be given, from lowest to highest as on the app's slider
+MOODS = ("Depressed", "Sad", "Okay", "Happy", "Elated")
+# Moods saved by earlier versions of the automatic scoring, with the mood they now map to
+LEGACY_MOODS = {"Neutral": "Okay", "Upset": "Depressed"}
+
+
+class OnnxEncoder:
+    """ MiniLM sentence encoder run with onnxruntime, from a model exported by export_onnx.py.
+
+    Needs neither torch nor sentence-transformers, so it loads faster and uses less memory
+    on CPU-only machines. The tokenizer is loaded once and kept with the session, and
+    embeddings are mean pooled over the tokens as SentenceTransformer does.
+
+    Args:
+        model_dir: Directory holding model_quantized.onnx (or model.onnx) and tokenizer.json
+        max_length: Maximum number of tokens per text, longer texts are truncated
+        threads: Optional number of threads for onnxruntime to use"""
+    def __init__(self, model_dir, max_length=256, threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        model_dir = Path(model_dir)
+        model_path = model_dir / "model_quantized.onnx"
+        if not model_path.exists():
+            model_path = model_dir / "model.onnx"
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+
+    def encode(self, sentences, batch_size=64, convert_to_numpy=True, normalize_embeddings=True):
+        """ Get an embedding for each text, as a float32 matrix with one row per text.
+
+        Takes the same arguments as SentenceTransformer.encode, so either can back a TopicClassifier.
+
+        Args:
+            sentences: List of texts to encode
+            batch_size: Number of texts to encode per forward pass
+            convert_to_numpy: Accepted for compatibility, a NumPy matrix is always returned
+            normalize_embeddings: Whether to scale each embedding to unit length"""
+        sentences = list(sentences)
+        batches = []
+        for i in range(0, len(sentences), batch_size):
+            encoded = self.tokenizer.encode_batch(sentences[i:i + batch_size])
+            ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            hidden = self.session.run(None, feeds)[0]
+
+            # Mean of the token embeddings, leaving out padding
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled.astype(np.float32))
+        return np.concatenate(batches) if batches else np.empty((0, 384), dtype=np.float32)
+
+
+class TopicClassifier:
+    """ Classify journal entries into one of the TOPICS using sentence embeddings.
+
+    The model is loaded and the topic descriptions are encoded once when the
+    classifier is created, so classifying an entry costs a single encode call.
+
+    Args:
+        model_name: Name of the SentenceTransformer model to load
+        topics: Dictionary of topic name to topic description
+        onnx_path: Optional directory of an exported ONNX model to run instead of PyTorch"""
+    def __init__(self, model_name='all-MiniLM-L6-v2', topics=TOPICS, onnx_path=None):
+        if onnx_path:
+            self.model = OnnxEncoder(onnx_path)
+        else:
+            # Imported here as torch is slow to import and only needed once a topic is wanted
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(model_name)
+        self.labels = list(topics.keys())
+        self.topic_embeddings = self.encode(list(topics.values()))
+
+    def encode(self, texts, batch_size=64):
+        """ Get unit-length embeddings for each text, as a float32 matrix with one row per text.
+
+        Args:
+            texts: List of texts to encode
+            batch_size: Number of texts to encode per forward pass"""
+        embeddings = self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+        return embeddings.astype(np.float32)
+
+    def classify_embeddings(self, embeddings):
+        """ Get the best matching topic for each row of an embedding matrix from encode().
+
+        Args:
+            embeddings: Matrix of unit-length embeddings"""
+        # Embeddings are unit length, so the dot product is the cosine similarity
+        sims = np.asarray(embeddings) @ self.topic_embeddings.T
+        return [self.labels[i] for i in sims.argmax(axis=1)]
+
+    def classify(self, text):
+        """ Get the best matching topic for a single text.
+
+        Args:
+            text: The text to classify"""
+        return self.classify_many([text])[0]
+
+    def classify_many(self, texts, batch_size=64):
+        """ Get the best matching topic for each text, encoding them in batches.
+
+        Args:
+            texts: List of texts to classify
+            batch_size: Number of texts to encode per forward pass"""
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.classify_embeddings(self.encode(texts, batch_size))
+
+
+# Classifier shared by the whole process, created on first use
+_topic_classifier = None
+_topic_classifier_lock = threading.Lock()
+
+
+def get_topic_classifier():
+    """ Get the process-wide TopicClassifier, loading the model on first use.
+
+    Set the TOPIC_ONNX_PATH environment variable (or Streamlit secret) to the directory
+    made by export_onnx.py to run the quantized ONNX model instead of PyTorch."""
+    global _topic_classifier
+    if _topic_classifier is None:
+        with _topic_classifier_lock:
+            if _topic_classifier is None:
+                _topic_classifier = TopicClassifier(onnx_path=os.environ.get("TOPIC_ONNX_PATH"))
+    return _topic_classifier
+
+
+# Local copy of the VADER lexicon checked before NLTK's data directories
+LEXICON_PATH = Path(__file__).parent / "vader_lexicon.txt"
+# Location of the lexicon within NLTK's data directories
+NLTK_LEXICON = "sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt"
+_lexicon_lock = threading.Lock()
+
+
+class SentimentEngine:
+    """ Score the sentiment of journal entries with NLTK's VADER, loading its lexicon once.
+
+    Nothing is downloaded while the app runs. The lexicon is read from lexicon_path, the
+    VADER_LEXICON_PATH environment variable, functions/vader_lexicon.txt, or NLTK's data
+    directories, in that order. Install it once with: python -m nltk.downloader vader_lexicon
+
+    Args:
+        lexicon_path: Optional path to a copy of vader_lexicon.txt"""
+    def __init__(self, lexicon_path=None):
+        # Imported here as NLTK is only needed once sentiment is wanted
+        from nltk.sentiment.vader import SentimentIntensityAnalyzer
+        self.analyser = SentimentIntensityAnalyzer(lexicon_file=_find_lexicon(lexicon_path))
+
+    def score(self, text):
+        """ Get the compound score and mood of a single text.
+
+        Args:
+            text: The text to score"""
+        return self.score_many([text])[0]
+
+    def score_many(self, texts):
+        """ Get the compound score and mood of each text, scoring repeated texts once.
+
+        Args:
+            texts: List of texts to score
+
+        Returns a list of (compound, mood) pairs, in the same order as the texts."""
+        scores = {}
+        results = []
+        for text in texts:
+            text = text or ""
+            if text not in scores:
+                compound = self.analyser.polarity_scores(text)["compound"]
+                scores[text] = (compound, SentimentFunctions.get_mood(compound))
+            results.append(scores[text])
+        return results
+
+
+def _find_lexicon(lexicon_path=None):
+    """ Get the NLTK resource name of the first VADER lexicon found, without downloading it.
+
+    NLTK only loads resources from its data directories, so the folder of a local copy is
+    added to the front of nltk.data.path and the copy is loaded by its file name."""
+    import nltk
+    path = lexicon_path or os.environ.get("VADER_LEXICON_PATH")
+    if not path and LEXICON_PATH.exists():
+        path = LEXICON_PATH
+    if path:
+        path = Path(path).resolve()
+        if not path.exists():
+            raise LookupError(f"VADER lexicon not found at {path}")
+        with _lexicon_lock:
+            if str(path.parent) not in nltk.data.path:
+                nltk.data.path.insert(0, str(path.parent))
+        return path.name
+    try:
+        nltk.data.find(NLTK_LEXICON)
+    except LookupError:
+        raise LookupError(
+            "VADER lexicon not found. Install it with 'python -m nltk.downloader vader_lexicon', "
+            "or set VADER_LEXICON_PATH to a copy of vader_lexicon.txt"
+        ) from None
+    return NLTK_LEXICON
+
+
+# Sentiment engine shared by the whole process, created on first use
+_sentiment_engine = None
+_sentiment_engine_lock = threading.Lock()
+
+
+def get_sentiment_engine():
+    """ Get the process-wide SentimentEngine, loading the lexicon on first use."""
+    global _sentiment_engine
+    if _sentiment_engine is None:
+        with _sentiment_engine_lock:
+            if _sentiment_engine is None:
+                _sentiment_engine = SentimentEngine()
+    return _sentiment_engine
+
+
 class SentimentFunctions:
     @staticmethod
     def get_sentiment(text):
         """ Analyse the sentiment of the given text using NLTK's VADER.
 
         Args:
-            text: The text to analyse"""
-        nltk.download('vader_lexicon', quiet=True)
-        sia = SentimentIntensityAnalyzer()
-        scores = sia.polarity_scores(text)
-        compound = scores['compound']
-    
+            text: The text to analyse
+
+        Returns the compound score (between -1 and 1) and the mood it falls in."""
+        return get_sentiment_engine().score(text)
+
+    def get_sentiments(texts):
+        """ Analyse the sentiment of each of the given texts.
+
+        Args:
+            texts: List of texts to analyse
+
+        Returns a list of (compound, mood) pairs, in the same order as the texts."""
+        return get_sentiment_engine().score_many(texts)
+
+    def get_mood(compound):
+        """ Bucket a VADER compound score into one of the app's MOODS.
+
+        Args:
+            compound: Compound sentiment score between -1 and 1"""
         if compound >= 0.5:
             emotion = "Elated"
         elif 0.05 <= compound < 0.5:
             emotion = "Happy"
         elif -0.05 < compound < 0.05:
-            emotion = "Neutral"
+            emotion = "Okay"
         elif -0.5 <= compound <= -0.05:
             emotion = "Sad"
         else:  # compound < -0.5
-            emotion = "Upset"
+            emotion = "Depressed"
     
-        return compound, emotion
+        return emotion
+
+    def normalise_mood(mood):
+        """ Get the mood from MOODS for a stored mood, including those saved under VADER's own names.
+
+        Args:
+            mood: Mood stored on an entry, or None
+
+        Returns the matching mood, or "Okay" if there is none."""
+        if mood in MOODS:
+            return mood
+        return LEGACY_MOODS.get(mood, "Okay")
     
     def get_topic(text):
-        model = SentenceTransformer('all-MiniLM-L6-v2')
-        topics = {
-            "family": "family, parents, auntie, Blair, Bo, James, Kezia, Serenity, Martha, spouse, partner",
-            "health": "health, wellbeing, exercise, meditation, running, walking, sleep, diet, food, nutrition, gym, tidy",
-            "work": "job, career, projects, Workdry, council, boss, colleagues, team",
-            "nature": "nature, parks, walks, outdoors, trees, greenery, hiking, steps, climbing, mountains",
-            "pets": "cats, pets, animals, Penny, Basil, kitty"
-        }
-
-        topic_embeddings = model.encode(list(topics.values()), convert_to_tensor=True)
-
-        entry_emb = model.encode(text, convert_to_tensor=True)
-        sims = util.cos_sim(entry_emb, topic_embeddings)[0]
-        best_idx = sims.argmax()
-        return list(topics.keys())[best_idx]
\ No newline at end of file
+        """ Identify the topic of the given text.
+
+        Args:
+            text: The text to classify"""
+        return get_topic_classifier().classify(text)
+
+    def get_topic_and_embedding(text):
+        """ Identify the topic of the given text, also returning its embedding so it can be stored.
+
+        Args:
+            text: The text to classify"""
+        classifier = get_topic_classifier()
+        embedding = classifier.encode([text])[0]
+        return classifier.classify_embeddings([embedding])[0], embedding
+
+    def get_topics(texts):
+        """ Identify the topic of each of the given texts in one batched pass.
+
+        Args:
+            texts: List of texts to classify"""
+        return get_topic_classifier().classify_many(texts)
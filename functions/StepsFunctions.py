@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# Set of Python functions for writing step counts from the async steps service.
+# These use the async Supabase client so a request never blocks a worker thread
+# on the database round trip.
+# https://supabase.com/
+
+# Imports
+import asyncio
+import logging
+from functions.JournalFunctions import JournalFunctions as jf
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncStepsFunctions:
+    @staticmethod
+    async def upsert_steps(supabase, records, chunk_size=1000):
+        """ Add or replace step count data for many dates in batched upserts keyed on stepdate.
+
+        Args:
+            supabase: Async Supabase client instance
+            records: List of (step_date, steps) pairs, dates as YYYY-MM-DD
+            chunk_size: Maximum number of rows sent per request
+
+        Returns the number of dates written.
+
+            To create an async supabase client instance
+            supabase: AsyncClient = await acreate_client(SUPABASE_URL, SUPABASE_KEY)"""
+        rows = jf.step_rows(records)
+        for i in range(0, len(rows), chunk_size):
+            await supabase.table("step").upsert(rows[i:i + chunk_size], on_conflict="stepdate").execute()
+        return len(rows)
+
+
+class StepsWriteBuffer:
+    """ Coalesce step writes arriving within a short window into one batched upsert.
+
+    Records for the same date are merged so only the latest count is written.
+    Call close() on shutdown to flush anything still buffered.
+
+    Args:
+        supabase: Async Supabase client instance
+        window: Seconds to wait after the first buffered record before writing
+        max_batch: Number of buffered dates that triggers an immediate write"""
+    def __init__(self, supabase, window=0.5, max_batch=500):
+        self.supabase = supabase
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._writing = False
+
+    async def add(self, records):
+        """ Buffer step records to be written with the next batch.
+
+        Args:
+            records: List of (step_date, steps) pairs, dates as YYYY-MM-DD"""
+        for step_date, steps in records:
+            self._pending[str(step_date)] = steps
+        if len(self._pending) >= self.max_batch:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        """ Write every buffered record in one batched upsert, returning the number of dates written."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                return await AsyncStepsFunctions.upsert_steps(self.supabase, list(batch.items()))
+            except BaseException:
+                # Put the batch back for the next flush (also if cancelled), without overwriting newer counts
+                self._pending = {**batch, **self._pending}
+                raise
+
+    async def close(self):
+        """ Stop the flush timer and write anything still buffered.
+
+        A timer that is already writing its batch is waited for rather than cancelled."""
+        while self._timer is not None and not self._timer.done():
+            if not self._writing:
+                self._timer.cancel()
+                break
+            # Awaiting may leave a retry timer in its place, which is cancelled on the next pass
+            await self._timer
+        await self.flush()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._writing = True
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to write buffered steps, will retry with the next batch")
+            if self._pending:
+                self._timer = asyncio.create_task(self._flush_later())
+        finally:
+            self._writing = False
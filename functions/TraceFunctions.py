@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+# Set of Python functions for tracing calls on the app's hot paths.
+# Instrumented functions record their call count and latency for the current
+# page render or request, shown in the app's debug panel, and in process-wide
+# latency histograms that the Steps API exposes in the Prometheus text format.
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+
+# Imports
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Trace of the page render or request running in this thread or task, if any
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Histogram:
+    """ Counts of observed latencies per bucket, with their sum, as in a Prometheus histogram.
+
+    Args:
+        buckets: Sorted upper bounds of the buckets in seconds"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        """ Record one latency.
+
+        Args:
+            seconds: The latency to record"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Metrics:
+    """ Latency histograms keyed on a metric name and labels.
+
+    Args:
+        buckets: Sorted upper bounds of the buckets in seconds"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._help = {}
+
+    def observe(self, name, seconds, description="", **labels):
+        """ Record one latency in the histogram for a metric name and labels.
+
+        Args:
+            name: Metric name, e.g. steps_api_request_duration_seconds
+            seconds: The latency to record
+            description: Help text for the metric
+            labels: Label names and values, e.g. the path of a request"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._help.setdefault(name, description)
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self.buckets)
+            series[key].observe(seconds)
+
+    def render(self):
+        """ Get every histogram in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    # Bucket counts are cumulative, ending with the +Inf bucket
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(key + (('le', _bound(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """ Forget every recorded latency."""
+        with self._lock:
+            self._histograms.clear()
+
+
+# Latencies of every traced call in this process
+metrics = Metrics()
+
+
+class Trace:
+    """ Call counts and latencies recorded during one page render or request.
+
+    Args:
+        name: Optional name of what is being traced, e.g. the page"""
+    def __init__(self, name=None):
+        self.name = name
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @property
+    def elapsed(self):
+        """ Seconds since the trace was started."""
+        return time.perf_counter() - self.start
+
+    def record(self, name, seconds):
+        """ Record one call.
+
+        Args:
+            name: Name of the function called
+            seconds: How long the call took"""
+        with self._lock:
+            calls = self._calls.setdefault(name, [0, 0.0, 0.0])
+            calls[0] += 1
+            calls[1] += seconds
+            calls[2] = max(calls[2], seconds)
+
+    def summary(self):
+        """ Get the count, total and slowest time of each function called, slowest in total first.
+
+        Times include any traced calls made inside, e.g. JournalFunctions.add_steps includes upsert_steps."""
+        with self._lock:
+            rows = [
+                {"function": name, "calls": count, "total_ms": total * 1000, "max_ms": slowest * 1000}
+                for name, (count, total, slowest) in self._calls.items()
+            ]
+        return sorted(rows, key=lambda row: -row["total_ms"])
+
+
+def start_trace(name=None):
+    """ Start a new trace for the page render or request running in this thread or task.
+
+    Calls made from other threads, e.g. the enrichment worker's, are only recorded in the metrics.
+
+    Args:
+        name: Optional name of what is being traced, e.g. the page"""
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    """ Get the trace started in this thread or task, or None."""
+    return _current_trace.get()
+
+
+def record(name, seconds):
+    """ Record one call in the current trace, if any, and in the process-wide metrics.
+
+    Args:
+        name: Name of the function called
+        seconds: How long the call took"""
+    metrics.observe("journal_call_duration_seconds", seconds, "Latency of traced function calls.", function=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(name, seconds)
+
+
+def traced(name, func):
+    """ Wrap a function, sync or async, so every call is recorded under a name.
+
+    Args:
+        name: Name to record calls under
+        func: The function to wrap"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def instrument(cls, names=None, prefix=None):
+    """ Wrap the public methods of a class in place so every call is traced.
+
+    Classes already instrumented are left alone, so this is safe to call on every rerun.
+
+    Args:
+        cls: The class to instrument, e.g. JournalFunctions
+        names: Optional method names to wrap, which may include private ones such as __init__
+        prefix: Name calls are recorded under before the method name, the class name by default"""
+    prefix = prefix or cls.__name__
+    for attr, value in list(vars(cls).items()):
+        if names is not None and attr not in names:
+            continue
+        if names is None and attr.startswith("_"):
+            continue
+        # Static methods are unwrapped and rewrapped, plain functions work either way
+        if isinstance(value, staticmethod):
+            func, rewrap = value.__func__, staticmethod
+        elif inspect.isfunction(value):
+            func, rewrap = value, None
+        else:
+            continue
+        if getattr(func, "__traced__", False):
+            continue
+        wrapper = traced(f"{prefix}.{attr}", func)
+        setattr(cls, attr, rewrap(wrapper) if rewrap else wrapper)
+    return cls
+
+
+def _labels(key):
+    """ Format label pairs as {name="value",...}, escaped as the exposition format requires."""
+    if not key:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in key
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _bound(bound):
+    """ Format a bucket bound as Prometheus does, e.g. 0.5 and +Inf."""
+    return "+Inf" if bound == float("inf") else repr(float(bound))
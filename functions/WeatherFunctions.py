@@ -4,7 +4,88 @@
 
 # Imports
 import os
+import time
+import threading
 import requests
+from datetime import date
+
+# OpenWeatherMap current weather endpoint
+WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+
+class WeatherProvider:
+    """ Current weather lookups over a pooled session, cached per location for a short time.
+
+    Args:
+        WeatherAPIKey: API key for OpenWeatherMap https://openweathermap.org/
+        ttl: Seconds a lookup is reused for the same location
+        timeout: Connect and read timeouts in seconds
+        precision: Decimal places lat/lon are rounded to for the cache key (2 is roughly 1km)"""
+    def __init__(self, WeatherAPIKey, ttl=600, timeout=(3.05, 10), precision=2):
+        self.api_key = WeatherAPIKey
+        self.ttl = ttl
+        self.timeout = timeout
+        self.precision = precision
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def get_weather(self, lat, lon):
+        """ Get current temperature and weather description for given latitude and longitude.
+
+        Args:
+            lat: Latitude
+            lon: Longitude"""
+        key = (round(float(lat), self.precision), round(float(lon), self.precision))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        response = self.session.get(
+            WEATHER_URL,
+            params={"lat": key[0], "lon": key[1], "units": "metric", "appid": self.api_key},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+        weather = (data['main']['temp'], data['weather'][0]['description'])
+        with self._lock:
+            self._cache[key] = (now + self.ttl, weather)
+        return weather
+
+    def get_weather_for_entry(self, entry, lat, lon):
+        """ Get temperature and weather description for a journal entry.
+
+        Weather already recorded on the entry is returned as is. Only entries for today
+        without weather are looked up, as past days cannot be given today's weather.
+
+        Args:
+            entry: Journal entry dictionary
+            lat: Latitude
+            lon: Longitude"""
+        if entry.get("weather") is not None and entry.get("temperature") is not None:
+            return entry["temperature"], entry["weather"]
+        if str(entry.get("entrydate"))[:10] != date.today().isoformat():
+            return entry.get("temperature"), entry.get("weather")
+        return self.get_weather(lat, lon)
+
+
+# Providers shared by the whole process, one per API key
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_weather_provider(WeatherAPIKey):
+    """ Get the process-wide WeatherProvider for an API key.
+
+    Args:
+        WeatherAPIKey: API key for OpenWeatherMap https://openweathermap.org/"""
+    with _providers_lock:
+        if WeatherAPIKey not in _providers:
+            _providers[WeatherAPIKey] = WeatherProvider(WeatherAPIKey)
+        return _providers[WeatherAPIKey]
 
 
 class WeatherFunctions:
@@ -15,6 +96,13 @@ class WeatherFunctions:
             lat: Latitude
             lon: Longitude
             WeatherAPIKey: API key for OpenWeatherMap https://openweathermap.org/"""
-        url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&units=metric&appid={WeatherAPIKey}"
-        response = requests.get(url).json()
-        return response['main']['temp'], response['weather'][0]['description']
+        return get_weather_provider(WeatherAPIKey).get_weather(lat, lon)
+
+    def get_weather_for_entry(entry, lat, lon, WeatherAPIKey):
+        """ Get weather data for a journal entry, only calling the API for today's entry if none is recorded.
+        Args:
+            entry: Journal entry dictionary
+            lat: Latitude
+            lon: Longitude
+            WeatherAPIKey: API key for OpenWeatherMap https://openweathermap.org/"""
+        return get_weather_provider(WeatherAPIKey).get_weather_for_entry(entry, lat, lon)
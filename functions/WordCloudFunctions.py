@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+# Set of Python functions for building the Home page word cloud.
+# Word counts are kept per entry in an index that is updated incrementally
+# as entries are added, edited or deleted, so the cloud is only laid out
+# again when the counts change.
+
+# Imports
+import json
+import hashlib
+import threading
+from collections import Counter
+from pathlib import Path
+from wordcloud import WordCloud, STOPWORDS
+
+# Words left out of the word cloud
+CUSTOM_STOPWORDS = STOPWORDS.union({
+    'today', 'really', 'just', 'like', 'one', 'something', 'got',
+    'feel', 'felt', 'time', 'day', 'much', 'make', 'made', 'wasn'
+    't', 's', 'm', 've', 'll',
+    "dont", "cant", "wont", "im", "youre", "hes", "shes", "its", "were", "theyre",
+    "wasnt", "werent", "isnt", "arent", "havent", "hasnt", "hadnt", "id", "youd",
+    "hed", "shed", "wed", "theyd", "ill", "youll", "hell", "shell", "well", "theyll",
+    "ive", "youve", "weve", "theyve", "whod", "wholl", "whos", "shouldnt", "wouldnt",
+    "couldnt", "mightnt", "mustnt", "neednt", "aint", "grateful", "someone else", "health",
+    "still", "someone", "thing", "things", "also", "even", "way", "ways",
+    "bit", "little", "lot", "lots", "part", "parts", "think", "know"
+})
+
+
+class WordIndex:
+    """ Term frequencies of every entry's text, updated one entry at a time.
+
+    Args:
+        path: Optional path to a JSON file to persist the index to
+        stopwords: Words to leave out of the counts"""
+    def __init__(self, path=None, stopwords=CUSTOM_STOPWORDS):
+        self.path = Path(path) if path else None
+        self._stopwords_hash = _text_hash(" ".join(sorted(stopwords)))
+        self._lock = threading.Lock()
+        self._tokeniser = WordCloud(stopwords=stopwords, collocations=False)
+        self._docs = {}
+        self._totals = Counter()
+        self.version = 0
+        self._image = None
+        self._image_version = None
+        if self.path and self.path.exists():
+            self._load()
+
+    def count_words(self, text):
+        """ Count the words of a single text, using the word cloud's own tokenising rules.
+
+        Args:
+            text: The text to count"""
+        text = (text or "").replace("’", "'")  # normalise curly apostrophes
+        text = text.replace("'", "")           # strip all apostrophes
+        return self._tokeniser.process_text(text)
+
+    def add(self, eid, text):
+        """ Add or replace the counts for one entry.
+
+        Args:
+            eid: Entry ID of the journal entry
+            text: Text content of the journal entry"""
+        with self._lock:
+            self._add(str(eid), text)
+            self._changed()
+
+    def remove(self, eid):
+        """ Remove the counts for one entry, e.g. when it is deleted.
+
+        Args:
+            eid: Entry ID of the journal entry"""
+        with self._lock:
+            if self._remove(str(eid)):
+                self._changed()
+
+    def sync(self, entries):
+        """ Bring the index in line with the given entries, only re-counting entries whose text changed.
+
+        Entries missing from the list (e.g. soft-deleted ones) are removed from the index.
+
+        Args:
+            entries: List of journal entry dictionaries with entryid and entrytext
+
+        Returns True if the index changed."""
+        with self._lock:
+            current = {str(e["entryid"]): e.get("entrytext") for e in entries}
+            changed = False
+            for eid in [eid for eid in self._docs if eid not in current]:
+                changed |= self._remove(eid)
+            for eid, text in current.items():
+                doc = self._docs.get(eid)
+                if doc is None or doc["hash"] != _text_hash(text):
+                    self._add(eid, text)
+                    changed = True
+            if changed:
+                self._changed()
+            return changed
+
+    def frequencies(self):
+        """ Get the total count of each word across all indexed entries.
+
+        As in WordCloud.process_text, different cases of a word are merged under its most
+        common case, and plurals are merged into the singular when both appear."""
+        with self._lock:
+            totals = dict(self._totals)
+
+        # Merge cases, keeping the most common spelling
+        merged = {}
+        for word, count in sorted(totals.items(), key=lambda item: -item[1]):
+            key = word.lower()
+            if key in merged:
+                merged[key][1] += count
+            else:
+                merged[key] = [word, count]
+
+        # Merge plurals into their singular
+        for key in list(merged):
+            if key.endswith("s") and not key.endswith("ss") and key[:-1] in merged:
+                merged[key[:-1]][1] += merged.pop(key)[1]
+        return {word: count for word, count in merged.values()}
+
+    def render(self, **options):
+        """ Render the word cloud as an image array, reusing the last render until the index changes.
+
+        Args:
+            options: Keyword arguments passed to WordCloud, e.g. width, height and colormap"""
+        # Colormaps are keyed by name as a new object may be passed on every rerun
+        key = (self.version, tuple(sorted((k, repr(getattr(v, "name", v))) for k, v in options.items())))
+        if self._image_version != key:
+            frequencies = self.frequencies()
+            if not frequencies:
+                return None
+            self._image = WordCloud(**options).generate_from_frequencies(frequencies).to_array()
+            self._image_version = key
+        return self._image
+
+    def _add(self, eid, text):
+        self._remove(eid)
+        counts = self.count_words(text)
+        self._docs[eid] = {"hash": _text_hash(text), "counts": counts}
+        self._totals.update(counts)
+
+    def _remove(self, eid):
+        doc = self._docs.pop(eid, None)
+        if doc is None:
+            return False
+        self._totals.subtract(doc["counts"])
+        for word in doc["counts"]:
+            if self._totals[word] <= 0:
+                del self._totals[word]
+        return True
+
+    def _changed(self):
+        self.version += 1
+        if self.path:
+            self._save()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        # Counts made with a different set of stopwords are rebuilt from scratch
+        if data.get("stopwords") != self._stopwords_hash:
+            return
+        self._docs = data["docs"]
+        for doc in self._docs.values():
+            self._totals.update(doc["counts"])
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"stopwords": self._stopwords_hash, "docs": self._docs}, f)
+
+
+def _text_hash(text):
+    """ Hash entry text so unchanged entries can be skipped."""
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
@@ -1,25 +1,82 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from functions.JournalFunctions import JournalFunctions as jf
+from functions.StepsFunctions import AsyncStepsFunctions as asf, StepsWriteBuffer
+from functions.LocalFunctions import LocalClient
+from functions.TraceFunctions import instrument, metrics
 import uvicorn
+import time
 import os
-from supabase import create_client, Client
+from supabase import acreate_client
 
 # Database connection
 SUPABASE_URL = os.environ.get("SUPABASE_URL") # railway
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY") # railway
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+LOCAL_DB_PATH = os.environ.get("LOCAL_DB_PATH") # set to use a local SQLite database instead
+# Seconds to coalesce incoming writes for, 0 writes each request straight away
+WRITE_BEHIND_SECONDS = float(os.environ.get("STEPS_WRITE_BEHIND_SECONDS", "0"))
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One async client, and so one pooled HTTP connection, for the life of the service
+    if LOCAL_DB_PATH:
+        app.state.supabase = LocalClient(LOCAL_DB_PATH, asynchronous=True)
+    else:
+        app.state.supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    app.state.buffer = StepsWriteBuffer(app.state.supabase, WRITE_BEHIND_SECONDS) if WRITE_BEHIND_SECONDS > 0 else None
+    yield
+    # Flush buffered writes so nothing is lost on shutdown
+    if app.state.buffer is not None:
+        await app.state.buffer.close()
+    await app.state.supabase.postgrest.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+# Database writes are timed in the journal_call_duration_seconds histogram
+instrument(asf)
+instrument(StepsWriteBuffer, names=["flush"])
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template rather than raw path, so unknown paths don't add series
+        route = request.scope.get("route")
+        metrics.observe(
+            "steps_api_request_duration_seconds", time.perf_counter() - start,
+            "Latency of Steps API requests.",
+            method=request.method, path=route.path if route else "unmatched", status=status
+        )
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 class StepsPayload(BaseModel):
     date: str
     steps: int
 
+async def write_steps(records):
+    if app.state.buffer is not None:
+        await app.state.buffer.add(records)
+        return len({date for date, _ in records})
+    return await asf.upsert_steps(app.state.supabase, records)
+
 @app.post("/add_steps")
-def receive_steps(payload: StepsPayload):
-    jf.add_steps(supabase, payload.date, payload.steps)
+async def receive_steps(payload: StepsPayload):
+    await write_steps([(payload.date, payload.steps)])
     return {"status": "ok", "message": "Steps recorded"}
 
+@app.post("/steps/bulk")
+async def receive_steps_bulk(payload: list[StepsPayload]):
+    count = await write_steps([(record.date, record.steps) for record in payload])
+    return {"status": "ok", "message": f"Steps recorded for {count} days"}
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)